@@ -20,8 +20,8 @@ __author__ = 'ke4roh'
 import RPi.GPIO as gpio
 from time import sleep
 import signal
-import Adafruit_GPIO.I2C
 from RPiNWR.Si4707 import Context
+from RPiNWR.i2cdev import I2CDevice
 
 # TODO wrap this so that it will be cleaned up EVERY time
 # --- see http://stackoverflow.com/questions/865115/how-do-i-correctly-clean-up-a-python-object#865272
@@ -46,11 +46,20 @@ class AIWIBoardContext(Context):
 
     relay_gpio_pins = [13, 19]
 
-    i2c = Adafruit_GPIO.I2C.get_i2c_device(0x11)
+    i2c = None  # Adafruit_GPIO.I2C device, shared
+
+    # Adafruit_GPIO logs every transfer (see demo.Radio.exclude_routine_status_checks)
+    chatty_i2c = True
 
     def __init__(self):
         super(AIWIBoardContext, self).__init__()
         self.gpio_started = False
+        self._open_i2c()
+
+    def _open_i2c(self):
+        if AIWIBoardContext.i2c is None:
+            import Adafruit_GPIO.I2C
+            AIWIBoardContext.i2c = Adafruit_GPIO.I2C.get_i2c_device(0x11)
 
     def reset_radio(self):
         """
@@ -86,15 +95,15 @@ class AIWIBoardContext(Context):
         sleep(1.5)
 
     def write_bytes(self, data):
-        # TODO make this accept bytes(...)
         if len(data) == 1:
             self.i2c.write8(data[0], 0)
         else:
-            self.i2c.writeList(data[0], data[1:])
+            self.i2c.writeList(data[0], list(data[1:]))  # smbus wants a list
 
-    def read_bytes(self, num_bytes):
-        # TODO make this return bytes(...)
-        return self.i2c.readList(0, num_bytes)
+    def read_into(self, buf):
+        data = self.i2c.readList(0, len(buf))
+        buf[0:len(data)] = bytes(data)
+        return len(data)
 
     def __enter__(self):
         # Make sure to cleanup GPIO afterward
@@ -138,3 +147,33 @@ class AIWIBoardContext(Context):
         else:
             status = gpio.LOW
         gpio.output(16, status)
+
+
+class AIWIBoardI2CDevContext(AIWIBoardContext):
+    """
+    The AIWI board, with the radio reached directly through /dev/i2c-* rather than Adafruit_GPIO.
+    Nothing is logged per transfer, so there is no need to filter out routine status checks.
+    """
+    chatty_i2c = False
+
+    def __init__(self, bus=1):
+        """
+        :param bus: the number of the bus, as in /dev/i2c-1
+        """
+        self.bus = bus
+        super(AIWIBoardI2CDevContext, self).__init__()
+
+    def _open_i2c(self):
+        self.i2c_device = I2CDevice(0x11, self.bus)
+
+    def write_bytes(self, data):
+        self.i2c_device.write(data)
+
+    def read_into(self, buf):
+        return self.i2c_device.read_into(buf)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            super(AIWIBoardI2CDevContext, self).__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self.i2c_device.close()
@@ -16,7 +16,6 @@ __author__ = 'ke4roh'
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import re
 import iso8601
 from RPiNWR.VTEC import VTEC
 from RPiNWR.CommonMessage import CommonMessage
@@ -24,53 +23,137 @@ from shapely.geometry import Polygon
 import time
 
 
-class CAPMessage(CommonMessage):
-    def __init__(self, dom):
-        #       self.status = dom.find('{urn:oasis:names:tc:emergency:cap:1.1}status').text
-        #       self.id = dom.find('{http://www.w3.org/2005/Atom}id').text
-        #       self.published, self.updated = [
-        #           iso8601.parse_date(self.__dom.find('{http://www.w3.org/2005/Atom}' + x).text).timestamp() for x in
-        #           ('published', 'updated')]
-
-        k = None
-        for x in dom.iter():
-            if x.tag == '{http://www.w3.org/2005/Atom}valueName':
-                k = x.text.strip()
-            elif k is not None and x.tag == '{http://www.w3.org/2005/Atom}value':
-                self.__dict__[k] = CAPMessage.__parse_date_or_text(x.text)
-            elif x.tag not in ["{urn:oasis:names:tc:emergency:cap:1.1}geocode",
-                               "{urn:oasis:names:tc:emergency:cap:1.1}parameter"]:
-                self.__dict__[x.tag[x.tag.find('}') + 1:]] = CAPMessage.__parse_date_or_text(x.text)
+_ATOM = '{http://www.w3.org/2005/Atom}'
+_CAP = '{urn:oasis:names:tc:emergency:cap:1.1}'
+
+# How to read each child of an entry: tag -> (field, kind)
+_TEXT, _DATE, _AUTHOR, _VALUES = range(4)
+_SCHEMA = {
+    _ATOM + 'id': ('id', _TEXT),
+    _ATOM + 'updated': ('updated', _DATE),
+    _ATOM + 'published': ('published', _DATE),
+    _ATOM + 'author': ('name', _AUTHOR),
+    _ATOM + 'title': ('title', _TEXT),
+    _ATOM + 'summary': ('summary', _TEXT),
+    _CAP + 'event': ('event', _TEXT),
+    _CAP + 'effective': ('effective', _DATE),
+    _CAP + 'expires': ('expires', _DATE),
+    _CAP + 'status': ('status', _TEXT),
+    _CAP + 'msgType': ('msgType', _TEXT),
+    _CAP + 'category': ('category', _TEXT),
+    _CAP + 'urgency': ('urgency', _TEXT),
+    _CAP + 'severity': ('severity', _TEXT),
+    _CAP + 'certainty': ('certainty', _TEXT),
+    _CAP + 'areaDesc': ('areaDesc', _TEXT),
+    _CAP + 'polygon': ('_polygon_text', _TEXT),
+    _CAP + 'geocode': (None, _VALUES),
+    _CAP + 'parameter': (None, _VALUES),
+}
+# Named values from geocode and parameter elements
+_VALUE_NAMES = ('FIPS6', 'UGC', 'VTEC')
+
+
+def _strip(text):
+    if text is None:
+        return None
+    return text.strip()
 
-        if self.FIPS6:
-            self.FIPS6 = re.sub("[\n\t ] +", " ", self.FIPS6.strip()).split(" ")
 
-        if self.polygon is not None and len(self.polygon.strip()) > 0:
-            self.polygon = re.sub("[\n\t ] +", " ", self.polygon)
-            self.polygon = Polygon([(float(x), float(y)) for x, y in [x.split(",") for x in self.polygon.split(" ")]])
-        else:
-            self.polygon = None
+class CAPMessage(CommonMessage):
+    """
+    A CAP alert, as summarized in an entry of the NWS Atom feed.  Only the fields in the schema above are
+    read; everything else in the entry is ignored.
 
-        try:
-            if self.__dict__['VTEC'] and len(self.VTEC):
-                self.vtec = VTEC.VTEC(self.VTEC, self)
+    The polygon and the VTEC codes are parsed the first time they are used, so entries which are not for
+    the area of interest cost little.
+    """
+    __slots__ = tuple(f for f, k in _SCHEMA.values() if f is not None) + _VALUE_NAMES + ('_polygon', '_vtec', '_fips', '_counties',
+                                                                                     '_whole_counties')
+
+    def __init__(self, dom):
+        for field in self.__slots__:
+            setattr(self, field, None)
+
+        for x in dom:
+            try:
+                field, kind = _SCHEMA[x.tag]
+            except KeyError:
+                continue
+            if kind is _TEXT:
+                setattr(self, field, _strip(x.text))
+            elif kind is _DATE:
+                text = _strip(x.text)
+                if text:  # Otherwise it's left None
+                    setattr(self, field, iso8601.parse_date(text).timestamp())
+            elif kind is _AUTHOR:
+                self.name = _strip(x.findtext(_ATOM + 'name'))
             else:
-                self.vtec = (NOVTEC(dom, self),)
-            if len(self.vtec) == 0:  # True if there was an invalid vtec code
-                self.vtec = (NOVTEC(dom, self),)
-        except KeyError:
-            self.vtec = (NOVTEC(dom, self),)
-
-    @staticmethod
-    def __parse_date_or_text(str):
-        try:
-            str = str.strip()
-        except AttributeError:
-            return str
-        try:
-            return iso8601.parse_date(str).timestamp()
-        except iso8601.iso8601.ParseError:
-            return str
+                k = None
+                for v in x:
+                    if v.tag == _ATOM + 'valueName':
+                        k = _strip(v.text)
+                    elif k in _VALUE_NAMES and v.tag == _ATOM + 'value':
+                        setattr(self, k, _strip(v.text))
+
+        if self.FIPS6:
+            self.FIPS6 = self.FIPS6.split()
+        self.__index_fips()
+
+    def __index_fips(self):
+        # Sets of codes for applies_to_fips: all the codes, all the counties (whatever the P digit), and counties
+        # named as a whole (P = 0)
+        codes = frozenset(c if len(c) == 6 else '0' + c for c in self.FIPS6 or ())
+        self._fips = codes
+        self._counties = frozenset(c[1:] for c in codes)
+        self._whole_counties = frozenset(c[1:] for c in codes if c[0] == '0')
+
+    @property
+    def polygon(self):
+        """
+        :return: the shapely Polygon of the warned area, or None if there isn't one
+        """
+        text = self._polygon_text
+        if text:
+            self._polygon = Polygon([(float(x), float(y)) for x, y in [x.split(",") for x in text.split()]])
+            self._polygon_text = None
+        return self._polygon
+
+    @property
+    def vtec(self):
+        """
+        :return: the VTEC codes in the message, or a NOVTEC if there are none (or none valid)
+        """
+        if self._vtec is None:
+            vtec = None
+            if self.VTEC:
+                vtec = VTEC.VTEC(self.VTEC, self)
+            if not vtec:
+                vtec = (NOVTEC(None, self),)
+            self._vtec = vtec
+        return self._vtec
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        # Messages pickled before there were slots have fields that are no longer kept, and had their polygon and
+        # vtec parsed already.
+        for k in self.__slots__:
+            setattr(self, k, state.get(k))
+        if 'polygon' in state:
+            self._polygon = state['polygon']
+        if 'vtec' in state:
+            self._vtec = state['vtec']
+        if self._fips is None:
+            self.__index_fips()
+
+    def _fields(self):
+        fields = super(CAPMessage, self)._fields()
+        for k in ('_polygon_text', '_polygon', '_vtec'):
+            fields.pop(k)
+        fields['polygon'] = self.polygon
+        fields['vtec'] = self.vtec
+        return fields
 
     def __str__(self):
         return "CAP [ %s %s %s %s ]" % (
@@ -91,22 +174,28 @@ class CAPMessage(CommonMessage):
     def get_areas(self):
         return self.FIPS6
 
+    def get_key(self):
+        return type(self), self.id, self.published
+
     def applies_to_fips(self, fips):
-        if not self.FIPS6:
-            return False
-        if fips.startswith('0'):
-            fips = '.' + fips[1:]
-        else:
-            fips = '[0' + fips[0] + ']' + fips[1:]
-        fips = '^' + fips + '$'
-        fp = re.compile(fips)
-        return len(list(filter(lambda c: fp.match(c), self.FIPS6))) > 0
+        """
+        :param fips: A string representing the FIPS code with optional leading P component to indicate subset of county
+        :return: True if the county is in the message, in the same sense as SAMEMessage.applies_to_fips
+        """
+        if len(fips) == 5:
+            fips = '0' + fips
+        if len(fips) != 6:
+            raise ValueError()
+        if fips[0] == '0':
+            return fips[1:] in self._counties
+        return fips in self._fips or fips[1:] in self._whole_counties
 
 
 class NOVTEC(VTEC):
     """
     For the occasion when the VTEC string isn't there (special weather statements, non-weather, etc.)
     """
+    __slots__ = ('event_type',)
 
     def __init__(self, dom, container):
         super().__init__(None, container)
@@ -21,6 +21,8 @@ import time
 
 
 class CommonMessage(object):
+    __slots__ = ()
+
     def is_effective(self, when=None):
         """
         :param when: The time for which to check effectiveness, default is now
@@ -38,11 +40,17 @@ class CommonMessage(object):
     def get_end_time_sec(self):
         raise NotImplemented()
 
+    def get_key(self):
+        """
+        :return: a hashable value identifying this message by its content - equal messages have equal keys
+        """
+        raise NotImplementedError()
+
     def __eq__(self, other):
         if type(other) is type(self):
             ignored = self._fields_to_skip_for_eq()
-            d1 = self.__dict__
-            d2 = other.__dict__
+            d1 = self._fields()
+            d2 = other._fields()
             for k1, v1 in d1.items():
                 if k1 not in ignored and (k1 not in d2 or d2[k1] != v1):
                     return False
@@ -52,5 +60,16 @@ class CommonMessage(object):
             return True
         return False
 
+    def _fields(self):
+        """
+        :return: a dict of the fields of this message, whether in slots or __dict__
+        """
+        fields = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for k in getattr(cls, '__slots__', ()):
+                if k != '__dict__' and hasattr(self, k):
+                    fields[k] = getattr(self, k)
+        return fields
+
     def _fields_to_skip_for_eq(self):
         return set([])
\ No newline at end of file
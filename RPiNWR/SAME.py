@@ -22,9 +22,12 @@ import time
 import logging
 import threading
 import functools
-import calendar
+import datetime
+import hashlib
+import collections
 from RPiNWR.nwr_data import *
 from RPiNWR.CommonMessage import CommonMessage
+from RPiNWR.alerts import AlertView
 
 # See http://www.nws.noaa.gov/directives/sym/pd01017012curr.pdf
 # also https://www.gpo.gov/fdsys/pkg/CFR-2010-title47-vol1/xml/CFR-2010-title47-vol1-sec11-31.xml
@@ -257,16 +260,105 @@ def _truncate(avgmsg, confidences):
     return avgmsg, confidences
 
 
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class _LRUMemo(object):
+    """
+    A bounded memo of results by key, which forgets the least recently used first, and counts hits and misses
+    as functools.lru_cache does
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__results = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: the result for the key, or None if there isn't one
+        """
+        with self.__lock:
+            result = self.__results.get(key, None)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.__results.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self.__lock:
+            self.__results[key] = result
+            self.__results.move_to_end(key)
+            while len(self.__results) > self.maxsize:
+                self.__results.popitem(last=False)
+
+    def cache_info(self):
+        with self.__lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self.__results))
+
+    def cache_clear(self):
+        with self.__lock:
+            self.__results.clear()
+            self.hits = self.misses = 0
+
+
+_average_memo = _LRUMemo(512)
+
+
+def _header_digest(headers, transmitter):
+    """
+    :return: a digest of everything average_message uses: the headers, their confidences, the transmitter, and
+       the minute the first header was received
+    """
+    digest = hashlib.blake2b(digest_size=16)
+
+    def add(s):
+        b = s.encode("utf-8", "surrogatepass")
+        digest.update(len(b).to_bytes(4, "big"))
+        digest.update(b)
+
+    add(str(transmitter))
+    add(str(int(headers[0][2] // 60)))
+    for msg, c, when in headers:
+        add(msg)
+        add(",".join(str(x) for x in c))
+    return digest.digest()
+
+
 def average_message(headers, transmitter):
     """
     Compute the correct message by averaging headers, restricting input to the valid character set, and filling
     in expected values when it's unambiguous based on other parts of the message.
 
+    The same headers are often decoded again (several receivers hear the same warning, and messages are
+    reconstituted from their headers), so the last several results are remembered.  See
+    average_message.cache_info() for the hits and misses, and average_message.cache_clear() to start over.
+
     :param headers: an array of tuples, each containing a string message and an array (or string) of confidence values.
        The complete message is assumed to be as long as the longest message, and messages align at the start.
     :return: a tuple containing a single string corresponding to the most certain available data, and
              the combined confidence for each character (range 1-9)
     """
+    if not headers:
+        return _average_message(headers, transmitter)
+    key = _header_digest(headers, transmitter)
+    result = _average_memo.get(key)
+    if result is None:
+        result = _average_message(headers, transmitter)
+        _average_memo.put(key, (result[0], tuple(result[1])))
+        return result
+    return result[0], list(result[1])
+
+
+average_message.cache_info = _average_memo.cache_info
+average_message.cache_clear = _average_memo.cache_clear
+
+
+def _average_message(headers, transmitter):
     # This implementation undertakes several steps
     # 1. Compute the best 2 out of 3 for every bit, weighted by confidence
     # 2. Compute the confidence of each byte (agreeing confidences - disagreeing confidences)
@@ -410,6 +502,26 @@ def average_message(headers, transmitter):
 SAME_PATTERN = re.compile('-(EAS|CIV|WXR|PEP)-([A-Z]{3})((?:-\\d{6})+)\\+(\\d{4})-(\\d{7})-([A-Z/]+)-?')
 
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_start_time(year, jjjhhmm):
+    """
+    :param year: the year of the message
+    :param jjjhhmm: the start time from the message, JJJHHMM, day of the year, hours, and minutes (UTC)
+    :return: seconds since the epoch
+    :raises ValueError: if it's not a valid time
+    """
+    if len(jjjhhmm) != 7 or not jjjhhmm.isdigit():
+        raise ValueError(jjjhhmm)
+    day, hour, minute = int(jjjhhmm[0:3]), int(jjjhhmm[3:5]), int(jjjhhmm[5:7])
+    if not (1 <= day <= 366 and hour < 24 and minute < 60):
+        raise ValueError(jjjhhmm)
+    when = datetime.datetime(year, 1, 1) + datetime.timedelta(days=day - 1, hours=hour, minutes=minute)
+    return (when - _EPOCH) // datetime.timedelta(seconds=1)
+
+
 class SAMEMessage(CommonMessage):
     """
     A SAMEMessage represents a message from NWR.
@@ -438,6 +550,7 @@ class SAMEMessage(CommonMessage):
 
         self.transmitter = transmitter
         self.__avg_message = None
+        self.__key = None
         self.received_callback = received_callback
         self.timeout = 0
         event_id = None
@@ -504,10 +617,24 @@ class SAMEMessage(CommonMessage):
             return self.__avg_message
         else:
             if len(self.headers) > 0:
-                return average_message(self.headers)
+                return average_message(self.headers, self.transmitter)
             else:
                 return "", []
 
+    def get_key(self):
+        """
+        :return: the transmitter, event id, and message text once the message is fully received.  Until then,
+           the text may yet change, so the message is only the same as itself.
+        """
+        if self.__key is None:
+            if not self.fully_received():
+                return type(self), id(self)
+            self.__key = (type(self), self.transmitter, self.event_id, self.get_SAME_message()[0])
+        return self.__key
+
+    def _fields_to_skip_for_eq(self):
+        return {'_SAMEMessage__key'}
+
     def get_originator(self):
         return self.get_SAME_message()[0][1:4]
 
@@ -540,7 +667,7 @@ class SAMEMessage(CommonMessage):
             year -= 1
         elif now.tm_yday > 355 and issue_jday < 10:
             year += 1
-        return calendar.timegm(time.strptime(str(year) + self.get_start_time_str() + 'UTC', '%Y%j%H%M%Z'))
+        return _parse_start_time(year, self.get_start_time_str())
 
     def get_end_time_sec(self):
         return self.get_start_time_sec() + self.get_duration_sec()
@@ -585,7 +712,8 @@ class SAMEMessage(CommonMessage):
             "message": self.get_SAME_message()[0],
             'confidence': self.get_SAME_message()[1],
             'headers': self.headers,
-            "time": self.start_time
+            "time": self.start_time,
+            "transmitter": self.transmitter
         }
 
 
@@ -640,54 +768,123 @@ class SAMECache(object):
     1. Receive SAME messages
     3. Provide a list of effective messages for a specific county in priority order
     4. Clear out inactive messages upon request
+    5. Tell subscribers when the effective messages change
+    6. Keep an index of the messages matching each registered MessageFilter
 
     Collaborators:
     Si4707 to populate via SAME message events
     A consumer, to monitor the messages and clear out inactive messages
+
+    Readers never wait on the lock.  The messages are held in a snapshot which is never changed once it is
+    published; a writer makes a new one and puts it in place of the old.
     """
     # TODO track the time since last received message for my fips, alert if >8 days
     # TODO monitor RSSI & SNR and alert if out of spec (what is spec)?
     def __init__(self, county_fips, same_sort=default_SAME_sort):
         self.__messages_lock = threading.Lock()
-        self.__messages = []
-        self.__elsewhere_messages = []
+        self.__snapshot = ((), ())  # (messages here, messages elsewhere)
         self.__local_messages = []
+        self.__views = {}  # here -> AlertView
+        self.__indexes = {}  # filter name -> (MessageFilter, (messages here, messages elsewhere)), replaced whole
         self.county_fips = county_fips
         self.same_sort = same_sort
 
     def add_message(self, message):
         with self.__messages_lock:
-            if self.county_fips is None or message.applies_to_fips(self.county_fips):
-                self.__messages.append(message)
+            here, elsewhere = self.__snapshot
+            is_here = self.county_fips is None or message.applies_to_fips(self.county_fips)
+            if is_here:
+                self.__snapshot = (here + (message,), elsewhere)
             else:
-                self.__elsewhere_messages.append(message)
+                self.__snapshot = (here, elsewhere + (message,))
+            indexes = None
+            for name, (message_filter, (matched_here, matched_elsewhere)) in self.__indexes.items():
+                if message_filter.matches(message):
+                    if indexes is None:
+                        indexes = dict(self.__indexes)
+                    if is_here:
+                        indexes[name] = (message_filter, (matched_here + (message,), matched_elsewhere))
+                    else:
+                        indexes[name] = (message_filter, (matched_here, matched_elsewhere + (message,)))
+            if indexes is not None:
+                self.__indexes = indexes
+            view = self.__views.get(is_here, None)
+            if view is not None:
+                view.update(message, (message.get_start_time_sec(), message.get_end_time_sec()))
+
+    def subscribe(self, listener, here=True):
+        """
+        :param listener: a function taking an AlertEvent, called each time the effective messages change.  It's
+           called with locks held, so it must not add messages itself.
+        :param here: True to hear about local messages, False for those for other locales
+        :return: the AlertView, whose messages are the effective messages in priority order
+        """
+        with self.__messages_lock:
+            view = self.__views.get(here, None)
+            if view is None:
+                view = AlertView(lambda m, when: m.is_effective(when), self.same_sort)
+                for m in self.__snapshot[0 if here else 1]:
+                    view.update(m, (m.get_start_time_sec(), m.get_end_time_sec()))
+                self.__views[here] = view
+        view.add_listener(listener)
+        return view
+
+    def unsubscribe(self, listener, here=True):
+        view = self.__views.get(here, None)
+        if view is not None:
+            view.remove_listener(listener)
+
+    def close(self):
+        """
+        Stop the subscriptions' timers
+        """
+        for view in self.__views.values():
+            view.close()
+
+    def add_filter(self, name, message_filter):
+        """
+        Register a filter, so that get_active_messages can go straight to the messages it matches
+        :param name: the name by which to ask for it
+        :param message_filter: a MessageFilter
+        """
+        with self.__messages_lock:
+            self.__index(name, message_filter)
+
+    def __index(self, name, message_filter):
+        """
+        Build the index for a filter from the present snapshot.  Call with the lock held.
+        """
+        indexes = dict(self.__indexes)
+        indexes[name] = (message_filter, tuple(tuple(filter(message_filter.matches, msgs)) for msgs in self.__snapshot))
+        self.__indexes = indexes
 
-    def get_active_messages(self, when=None, event_pattern=None, here=True):
+    def get_active_messages(self, when=None, event_pattern=None, here=True, filter_name=None):
         """
         :param when: the time for which to check effectiveness of the messages, default = the present time
         :param event_pattern: a regular expression to match the desired event codes.  default = all.
         :param here: True to retrieve local messages, False to retrieve those for other locales
+        :param filter_name: the name of a filter given to add_filter, to consider only the messages it matches
         """
         if when is None:
             when = time.time()
-        if event_pattern is None:
-            event_pattern = re.compile(".*")
-        elif not hasattr(event_pattern, 'match'):
+        if event_pattern is not None and not hasattr(event_pattern, 'match'):
             event_pattern = re.compile(event_pattern)
 
-        if here:
-            msgs = self.__messages
+        if filter_name is None:
+            msgs = self.__snapshot[0 if here else 1]
         else:
-            msgs = self.__elsewhere_messages
+            msgs = self.__indexes[filter_name][1][0 if here else 1]
 
-        l = list(filter(lambda m: m.is_effective(when) and event_pattern.match(m.get_event_type()), msgs))
+        l = list(filter(lambda m: m.is_effective(when) and (
+            event_pattern is None or event_pattern.match(m.get_event_type())), msgs))
         l.sort(key=functools.cmp_to_key(self.same_sort))
         return l
 
     def clear_inactive(self, when=None):
         with self.__messages_lock:
-            self.__messages = self.get_active_messages(when)
-            self.__elsewhere_messages = self.get_active_messages(when, here=False)
+            self.__snapshot = (tuple(self.get_active_messages(when)), tuple(self.get_active_messages(when, here=False)))
+            for name, (message_filter, index) in list(self.__indexes.items()):
+                self.__index(name, message_filter)
 
 
 def _unicodify(str):
@@ -31,12 +31,22 @@ from RPiNWR.Si4707.commands import *
 from RPiNWR.Si4707.data import *
 from RPiNWR.Si4707.events import *
 from RPiNWR.Si4707.exceptions import *
+from RPiNWR.Si4707.buffer import EventBuffer
 from RPiNWR.nwr_data import *
 
+_GET_INT_STATUS = b'\x14'
+
 
 class Si4707(object):
-    def __init__(self, context):
-        self.__event_queue = queue.Queue(maxsize=50)
+    def __init__(self, context, event_buffer=None):
+        """
+        :param context: the Context through which to talk to the chip
+        :param event_buffer: an EventBuffer to hold events until the listeners get them, None for the default
+        """
+        if event_buffer is None:
+            event_buffer = EventBuffer()
+        self.event_buffer = event_buffer  # Remains available after shutdown for its counters
+        self.__event_queue = event_buffer
         self.__command_queue = queue.PriorityQueue(maxsize=50)
         self.__command_serial_number = 0
         self.__command_serial_number_lock = threading.Lock()
@@ -47,6 +57,8 @@ class Si4707(object):
         self.context = context
         self.radio_power = False  # Off to begin with
         self.status = None  # Gonna fix this in __enter__
+        self.__status_buffer = bytearray(1)
+        self.__read_buffers = {}
         self.stop = False  # True to stop threads
         self.__shutdown = False  # True once shutdown has commenced
         self.tone_start = None
@@ -60,9 +72,12 @@ class Si4707(object):
             retries = 2
             while retries >= 0:
                 retries -= 1
+                start = time.time()
                 self.context.reset_radio()
                 try:
                     self.wait_for_clear_to_send(timeout=5)
+                    self._logger.info("Reset in %d ms" % int((time.time() - start) * 1000))
+                    break
                 except IOError:
                     if retries == 0:
                         raise
@@ -185,22 +200,31 @@ class Si4707(object):
         self._logger.debug("Scheduled " + str(event) + " for " + str(when) + " which is " + str(
             int((when - time.time()) * 1000)) + " ms in the future.")
 
-    def wait_for_clear_to_send(self, timeout=1.0):
+    def wait_for_clear_to_send(self, timeout=1.0, poll_interval=.002):
         """
         :param: timeout - in seconds, how long to wait.  Default=1
-        :return: the current status which can be inspected for CTS
+        :param: poll_interval - in seconds, how long to sleep between checks.  0 to check again right away.
+        :return: the current status (StatusFlags) which can be inspected for CTS
         :raises: StatusError if the status indicates CTS and an error
                  NotClearToSend if the time expires without getting a CTS
         """
+        # This runs hundreds of times per second, so it reads into a reusable buffer and decodes
+        # with a table lookup.  A Status is only built when there's an error to raise.
+        expiry = None
         if timeout is not None:
             expiry = timeout + time.time()
+        buf = self.__status_buffer
         while expiry is None or time.time() < expiry:
             try:
-                self.status = Status(self.context.read_bytes(1))
-                if self.status.is_clear_to_send():
-                    return self.status
-                else:
-                    time.sleep(.002)
+                self.context.read_into(buf)
+                status = STATUS_FLAGS[buf[0]]
+                if status.clear_to_send:
+                    self.status = status
+                    if status.error:
+                        Status(bytes(buf))  # raises StatusError
+                    return status
+                elif poll_interval:
+                    time.sleep(poll_interval)
             except OSError as e:
                 if e.errno == 5:  # I/O error - GPIO is busted
                     self.stop = 1
@@ -209,16 +233,30 @@ class Si4707(object):
                 raise
         raise NotClearToSend()
 
+    def _read(self, num_bytes):
+        """
+        Read from the radio into a buffer that is reused for every read of the same length.  This is for
+        commands, on the command thread.  Decode the result before reading again.
+
+        :param num_bytes: How many bytes to read
+        :return: a bytearray of num_bytes from the radio
+        """
+        buf = self.__read_buffers.get(num_bytes)
+        if buf is None:
+            buf = self.__read_buffers[num_bytes] = bytearray(num_bytes)
+        self.context.read_into(buf)
+        return buf
+
     def check_interrupts(self):
         """
         Ask the chip if there are interrupts.  Update status accordingly.
 
-        :return: the result of Status.is_interrupt() which is true if there are any, and bitwise indicates
+        :return: the status, of which is_interrupt() is true if there are any, and bitwise indicates
         the actual interrupts at hand, but subsequent examination of self.status is preferable for identifying
         which interrupts.
         """
         self.wait_for_clear_to_send(timeout=5)
-        self.context.write_bytes([0x14])  # GET_INT_STATUS Tell Si4707 to populate interrupt bits
+        self.context.write_bytes(_GET_INT_STATUS)  # Tell Si4707 to populate interrupt bits
         return self.wait_for_clear_to_send(timeout=.1)
 
     def register_event_listener(self, callback):
@@ -229,7 +267,8 @@ class Si4707(object):
 
     def _fire_event(self, event):
         """
-        Put an event on the event queue
+        Put an event on the event queue.  If the listeners have fallen behind, the event buffer
+        decides what to shed; this never fails for want of room.
         """
         try:
             self.__event_queue.put_nowait(event)
@@ -483,14 +522,30 @@ class Context(object):
     def write_bytes(self, data):
         """
         Send bytes to the radio.
-        :param data: an array of numbers to be interpreted as bytes, or bytes()
+        :param data: a bytes-like object (bytes, bytearray, or memoryview).  The first byte is the command.
+          Do not hold on to it after returning; it may be a view of a buffer that will be reused.
         """
         raise NotImplemented()
 
+    def read_into(self, buf):
+        """
+        Fill a buffer with bytes from the radio.  This is how Si4707 reads.
+        :param buf: a bytearray (or other writable buffer), as long as the number of bytes wanted (Max ~32)
+        :return: the number of bytes read
+        """
+        if type(self).read_bytes is Context.read_bytes:
+            raise NotImplementedError()
+        # Contexts written before read_into only provide read_bytes
+        data = self.read_bytes(len(buf))
+        buf[0:len(data)] = bytes(data)
+        return len(data)
+
     def read_bytes(self, num_bytes):
         """
-        Return bytes from the radio
+        Return bytes from the radio.  This is a convenience; implement read_into instead.
         :param num_bytes: How many do you want? (Max ~32)
         :return: bytes()
         """
-        raise NotImplemented()
+        buf = bytearray(num_bytes)
+        self.read_into(buf)
+        return bytes(buf)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# A bounded event buffer which sheds load instead of failing the command thread
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import queue
+import threading
+import time
+from RPiNWR.Si4707.events import *
+from RPiNWR.Si4707.commands import *
+
+# Event priorities.  When the buffer is full, the lowest priority event is dropped first.
+ROUTINE = 0
+NOTABLE = 1
+URGENT = 2
+ESSENTIAL = 3  # never dropped
+
+
+def default_event_priority(event):
+    """
+    :param event: an event headed for the listeners
+    :return: ESSENTIAL, URGENT, NOTABLE, or ROUTINE
+    """
+    if isinstance(event, SAMEMessageReceivedEvent):
+        return ESSENTIAL
+    if isinstance(event, SAMEEvent):
+        return URGENT
+    if isinstance(event, (SameInterruptCheck, AlertToneCheck, CommandExceptionEvent, RadioPowerEvent,
+                          ReadyToTuneEvent)):
+        return NOTABLE
+    return ROUTINE
+
+
+def default_coalesce_key(event):
+    """
+    Status reports only matter for their latest value, so a newer one can stand in for an older one
+    still waiting in the buffer.
+
+    :param event: an event headed for the listeners
+    :return: a key shared by events that supersede one another, or None if the event must be delivered on its own
+    """
+    if isinstance(event, (ReceivedSignalQualityCheck, TuneStatus, GetAGCStatus)):
+        return type(event)
+    return None
+
+
+class EventBuffer(object):
+    """
+    EventBuffer stands in for the queue.Queue between the command thread and the event thread.  Unlike a Queue,
+    put_nowait never raises queue.Full.  When the buffer is full:
+
+    1. A status event replaces an older, undelivered one of the same kind (coalesced)
+    2. Otherwise the lowest-priority event, queued or incoming, is discarded (dropped)
+    3. ESSENTIAL events are never dropped, so the buffer may exceed maxsize to hold them
+
+    Counters for dropped and coalesced events are kept for diagnostics.
+    """
+
+    def __init__(self, maxsize=50, priority=default_event_priority, coalesce_key=default_coalesce_key):
+        """
+        :param maxsize: how many events to hold before shedding load
+        :param priority: a function taking an event and returning its priority (see ESSENTIAL etc.)
+        :param coalesce_key: a function taking an event and returning a key identifying events that supersede
+           one another, or None if it must not be coalesced
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize=%d" % maxsize)
+        self.maxsize = maxsize
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.dropped = 0
+        self.coalesced = 0
+        self.__events = collections.deque()
+        self.__unfinished = 0
+        self.__lock = threading.Lock()
+        self.__not_empty = threading.Condition(self.__lock)
+        self._logger = logging.getLogger(type(self).__name__)
+
+    def put_nowait(self, event):
+        """
+        Add an event to the buffer, shedding load if it is full.
+
+        :return: True if the event was queued, False if it was dropped
+        """
+        with self.__lock:
+            if len(self.__events) >= self.maxsize and not self.__make_room(event):
+                return False
+            self.__events.append(event)
+            self.__unfinished += 1
+            self.__not_empty.notify()
+            return True
+
+    def __make_room(self, event):
+        """
+        Remove one event from the full buffer to make room for the given one.  Call with the lock held.
+
+        :return: True if the given event should go in the buffer, False if it was dropped instead
+        """
+        key = self.coalesce_key(event)
+        if key is not None:
+            for i, queued in enumerate(self.__events):
+                if self.coalesce_key(queued) == key:
+                    del self.__events[i]
+                    self.__unfinished -= 1
+                    self.coalesced += 1
+                    return True
+
+        incoming_priority = self.priority(event)
+        lowest = None
+        lowest_priority = incoming_priority
+        for i, queued in enumerate(self.__events):
+            p = self.priority(queued)
+            if p < lowest_priority:
+                lowest, lowest_priority = i, p
+
+        if lowest is not None:
+            self._logger.debug("Dropped %s" % type(self.__events[lowest]).__name__)
+            del self.__events[lowest]
+            self.__unfinished -= 1
+            self.dropped += 1
+            return True
+        if incoming_priority >= ESSENTIAL:
+            return True  # Grow past maxsize rather than lose it
+        self._logger.debug("Dropped %s" % type(event).__name__)
+        self.dropped += 1
+        return False
+
+    def get(self, block=True, timeout=None):
+        """
+        :return: the oldest event in the buffer
+        :raises queue.Empty: if there is none before the timeout or if not blocking
+        """
+        with self.__not_empty:
+            if block:
+                if timeout is None:
+                    while not len(self.__events):
+                        self.__not_empty.wait()
+                else:
+                    expiry = time.time() + timeout
+                    while not len(self.__events):
+                        remaining = expiry - time.time()
+                        if remaining <= 0:
+                            raise queue.Empty()
+                        self.__not_empty.wait(remaining)
+            elif not len(self.__events):
+                raise queue.Empty()
+            return self.__events.popleft()
+
+    def task_done(self):
+        with self.__lock:
+            if self.__unfinished <= 0:
+                raise ValueError("task_done() called too many times")
+            self.__unfinished -= 1
+
+    def empty(self):
+        with self.__lock:
+            return not len(self.__events)
+
+    def qsize(self):
+        with self.__lock:
+            return len(self.__events)
+
+    def __str__(self):
+        return "%s [size: %d, maxsize: %d, dropped: %d, coalesced: %d]" % (
+            type(self).__name__, self.qsize(), self.maxsize, self.dropped, self.coalesced)
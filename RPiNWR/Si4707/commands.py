@@ -18,6 +18,7 @@ __author__ = 'ke4roh'
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import functools
 from RPiNWR.Si4707.data import *
 from RPiNWR.Si4707.events import *
 import RPiNWR.SAME as SAME
@@ -27,6 +28,13 @@ import RPiNWR.SAME as SAME
 #
 # Commands are issued to the radio to manipulate it.
 ###############################################################################
+
+# Responses, decoded straight out of the radio's read buffers
+_GET_PROPERTY_RESPONSE = struct.Struct(">xxH")
+_TUNE_STATUS_RESPONSE = struct.Struct(">xxHbb")
+_RSQ_STATUS_RESPONSE = struct.Struct(">xbbxbbxb")
+_ASQ_STATUS_RESPONSE = struct.Struct(">xbb")
+
 class Command(Symbol):
     def __init__(self, mnemonic=None, value=None):
         """
@@ -73,7 +81,7 @@ class Command(Symbol):
 
     def do_command0(self, radio):
         # This implementation will handle a rudimentary command with no args
-        radio.context.write_bytes([self.value])
+        radio.context.write_bytes(bytes((self.value,)))
         return radio.wait_for_clear_to_send()
 
     def _check_interrupt(self, radio):
@@ -121,11 +129,15 @@ class PowerUp(Command):
         self.function = function
         self.opmode = opmode
         self.status = Status([0])
+        self.duration = None  # seconds to power up
 
     def do_command0(self, radio):
+        start = time.time()
         result = self.do_command00(radio)
+        self.duration = time.time() - start
+        self._logger.info("Powered up in %d ms" % int(self.duration * 1000))
         if self.function == 15:
-            result = radio.revision = PupRevision(radio.context.read_bytes(8))
+            result = radio.revision = PupRevision(radio._read(8))
         else:
             radio.radio_power = True
             radio._fire_event(RadioPowerEvent(True))
@@ -138,13 +150,13 @@ class PowerUp(Command):
         return result
 
     def do_command00(self, radio):
-        radio.context.write_bytes([self.value,
-                                   _bit(self.cts_interrupt_enable, 7) |
-                                   _bit(self.gpo2_output_enable, 6) |
-                                   _bit(self.patch, 5) |
-                                   _bit(self.crystal_oscillator_enable, 4) |
-                                   self.function,
-                                   self.opmode])
+        radio.context.write_bytes(bytes((self.value,
+                                         _bit(self.cts_interrupt_enable, 7) |
+                                         _bit(self.gpo2_output_enable, 6) |
+                                         _bit(self.patch, 5) |
+                                         _bit(self.crystal_oscillator_enable, 4) |
+                                         self.function,
+                                         self.opmode)))
         return radio.wait_for_clear_to_send()
 
     def get_priority(self):
@@ -171,11 +183,12 @@ class PatchCommand(PowerUp):
 
     def do_command00(self, radio):
         super(PatchCommand, self).do_command00(radio)
-        patch = self.__decompress_patch(self.patch)
+        patch = memoryview(_decompress_patch(self.patch))
 
+        # The chip takes each 8 bytes in a few microseconds, so don't sleep between polls
         for i in range(0, len(patch), 8):
-            radio.context.write_bytes(list(patch[i:i + 8]))
-            radio.wait_for_clear_to_send()
+            radio.context.write_bytes(patch[i:i + 8])
+            radio.wait_for_clear_to_send(poll_interval=0)
 
         new_rev = GetRevision().do_command0(radio)
         # Revision [mchip_rev: 0, patch_id: 53653, component_revision: 2.0, part_number: 7, firmware: 2.0]
@@ -186,13 +199,18 @@ class PatchCommand(PowerUp):
         return new_rev
 
 
-    @staticmethod
-    def __decompress_patch(patch):
-        import zlib
-        import base64
+@functools.lru_cache(maxsize=4)
+def _decompress_patch(patch):
+    """
+    The patch is applied at every power up, so decode it only once.
+    :param patch: base64 encoded, zlib-compressed patch
+    :return: bytes of the patch
+    """
+    import zlib
+    import base64
 
-        # Revision [mchip_rev: 0, patch_id: 53653, component_revision: 2.0, part_number: 7, firmware: 2.0]
-        return zlib.decompress(base64.b64decode(patch))
+    # Revision [mchip_rev: 0, patch_id: 53653, component_revision: 2.0, part_number: 7, firmware: 2.0]
+    return zlib.decompress(base64.b64decode(patch))
 
 
 class CommandRequiringPowerUp(Command):
@@ -212,7 +230,7 @@ class GetRevision(CommandRequiringPowerUp):
 
     def do_command0(self, radio):
         super(GetRevision, self).do_command0(radio)
-        revision = radio.revision = Revision(radio.context.read_bytes(9))
+        revision = radio.revision = Revision(radio._read(9))
         return revision
 
 
@@ -239,9 +257,7 @@ class SetProperty(CommandRequiringPowerUp):
             raise ValueError("0x%04X out of range" % new_value)
 
     def do_command0(self, radio):
-        c = [self.value]
-        c.extend(list(struct.pack(">bHH", 0, self.property.code, self.property.value)))
-        radio.context.write_bytes(c)
+        radio.context.write_bytes(struct.pack(">BbHH", self.value, 0, self.property.code, self.property.value))
 
 
 class GetProperty(CommandRequiringPowerUp):
@@ -250,9 +266,9 @@ class GetProperty(CommandRequiringPowerUp):
         self.property = Property(property_mnemonic)
 
     def do_command0(self, radio):
-        radio.context.write_bytes([self.value, 0, self.property.code >> 8, self.property.code & 0xFF])
+        radio.context.write_bytes(struct.pack(">BbH", self.value, 0, self.property.code))
         radio.wait_for_clear_to_send()
-        self.property.value = struct.unpack(">xxH", bytes(radio.context.read_bytes(4)))[0]
+        self.property.value = _GET_PROPERTY_RESPONSE.unpack_from(radio._read(4))[0]
         return self.property.value
 
 
@@ -272,9 +288,7 @@ class TuneFrequency(CommandRequiringPowerUp):
         while time.time() < radio.tune_after:
             # check back occasionally to see if the tune_after might have changed favorably
             time.sleep(max(.1, radio.tune_after - time.time()))
-        c = [self.value]
-        c.extend(list(struct.pack(">bH", 0, self.frequency)))
-        radio.context.write_bytes(c)
+        radio.context.write_bytes(struct.pack(">BbH", self.value, 0, self.frequency))
         radio.tone_start = None
         while not radio.check_interrupts().is_seek_tune_complete():  # wait for STC
             time.sleep(0.02)
@@ -296,10 +310,9 @@ class TuneStatus(CommandRequiringPowerUp):
         self.snr = None
 
     def do_command0(self, radio):
-        radio.context.write_bytes([self.value, self.intack & 1])  # Acknowledge STC, get tune status
+        radio.context.write_bytes(bytes((self.value, self.intack & 1)))  # Acknowledge STC, get tune status
         radio.wait_for_clear_to_send()
-        bl = radio.context.read_bytes(6)
-        self.frequency, self.rssi, self.snr = struct.unpack(">xxHbb", bytes(bl))
+        self.frequency, self.rssi, self.snr = _TUNE_STATUS_RESPONSE.unpack_from(radio._read(6))
         return self.frequency / 400.0, self.rssi, self.snr
 
 
@@ -323,10 +336,10 @@ class ReceivedSignalQualityCheck(InterruptHandler):
         self.rssi_low = None
 
     def do_command0(self, radio):
-        radio.context.write_bytes([self.value, self.intack & 1])
+        radio.context.write_bytes(bytes((self.value, self.intack & 1)))
         radio.wait_for_clear_to_send()
         violation_flags, validity, self.rssi, self.asnr, self.frequency_offset = \
-            struct.unpack(">xbbxbbxb", bytes(radio.context.read_bytes(8)))
+            _RSQ_STATUS_RESPONSE.unpack_from(radio._read(8))
         self.afc_rail = validity & 2 != 0
         self.valid_channel = validity & 1 != 0
         self.snr_high = violation_flags & 8 != 0
@@ -346,10 +359,9 @@ class AlertToneCheck(InterruptHandler):
         self.duration = None
 
     def do_command0(self, radio):
-        radio.context.write_bytes([self.value, self.intack & 1])
+        radio.context.write_bytes(bytes((self.value, self.intack & 1)))
         radio.wait_for_clear_to_send()
-        history, present = \
-            struct.unpack(">xbb", bytes(radio.context.read_bytes(3)))
+        history, present = _ASQ_STATUS_RESPONSE.unpack_from(radio._read(3))
         self.tone_start = history & 1 != 0
         self.tone_end = history & 2 != 0
         self.tone_on = present != 0
@@ -429,9 +441,9 @@ class SameInterruptCheck(InterruptHandler):
         return msg
 
     def __get_status(self, radio, readaddr=0, clearbuf=False, intack=False):
-        radio.context.write_bytes([self.value, (clearbuf & 1) << 1 | (intack & 1), readaddr])
+        radio.context.write_bytes(bytes((self.value, (clearbuf & 1) << 1 | (intack & 1), readaddr)))
         radio.wait_for_clear_to_send()
-        data = radio.context.read_bytes(14)
+        data = radio._read(14)
         confidence = [0] * 8
         for i in range(0, 8):
             confidence[i] = data[int((7 - i) / 4) + 4] >> (i % 4 * 2) & 0x3
@@ -444,7 +456,7 @@ class SameInterruptCheck(InterruptHandler):
             "STATE": data[2],
             "MSGLEN": data[3],
             "CONFIDENCE": confidence,
-            "MESSAGE": data[6:14]
+            "MESSAGE": bytes(data[6:14])
         }
 
 
@@ -454,7 +466,7 @@ class GetAGCStatus(CommandRequiringPowerUp):
 
     def do_command0(self, radio):
         super(GetAGCStatus, self).do_command0(radio)
-        return radio.context.read_bytes(2)[1] != 0
+        return radio._read(2)[1] != 0
 
 
 class SetAGCStatus(CommandRequiringPowerUp):
@@ -463,7 +475,7 @@ class SetAGCStatus(CommandRequiringPowerUp):
         self.enable = enable
 
     def do_command0(self, radio):
-        radio.context.write_bytes([self.value, self.enable & 1])
+        radio.context.write_bytes(bytes((self.value, self.enable & 1)))
         radio.wait_for_clear_to_send()
 
 
@@ -18,6 +18,7 @@ __author__ = 'ke4roh'
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import struct
+import collections
 from RPiNWR.Si4707.exceptions import StatusError
 
 DEFAULT_CONFIG = {
@@ -154,6 +155,42 @@ class Status(Symbol):
         return self.value & 0x0F
 
 
+class StatusFlags(collections.namedtuple("StatusFlags", ["value", "clear_to_send", "error",
+                                                         "received_signal_quality_interrupt", "same_interrupt",
+                                                         "audio_signal_quality_interrupt", "seek_tune_complete"])):
+    """
+    The status byte, already decoded.  This answers the same questions as Status, but there is one
+    of these for every possible status byte in STATUS_FLAGS, so polling the chip allocates nothing.
+    """
+    __slots__ = ()
+
+    def is_clear_to_send(self):  # CTS
+        return self.clear_to_send
+
+    def is_error(self):
+        return self.error
+
+    def is_received_signal_quality_interrupt(self):
+        return self.received_signal_quality_interrupt
+
+    def is_same_interrupt(self):
+        return self.same_interrupt
+
+    def is_audio_signal_quality_interrupt(self):
+        return self.audio_signal_quality_interrupt
+
+    def is_seek_tune_complete(self):  # STC
+        return self.seek_tune_complete
+
+    def is_interrupt(self):
+        return self.value & 0x0F
+
+
+# Indexed by status byte
+STATUS_FLAGS = tuple(StatusFlags(b, b & 1 << 7 != 0, b & 1 << 6 != 0, b & 1 << 3 != 0, b & 1 << 2 != 0,
+                                 b & 1 << 1 != 0, b & 1 != 0) for b in range(256))
+
+
 class PupRevision(Symbol):
     """
     Revision information coming from PowerUp function 15
@@ -44,10 +44,16 @@ class MockContext(Context):
         if len(data) == 1:
             self.write8(data[0], 0)
         else:
-            self.writeList(data[0], data[1:])
+            self.writeList(data[0], list(data[1:]))  # The chip keeps its own copy
 
-    def read_bytes(self, num_bytes):
-        return self.readList(0, num_bytes)
+    def read_into(self, buf):
+        registers = self.registers[0]
+        for i in range(0, len(buf)):
+            if i < len(registers):
+                buf[i] = registers[i]
+            else:
+                buf[i] = 0
+        return len(buf)
 
     def reset_radio(self):
         self.__init__()
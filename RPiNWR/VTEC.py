@@ -16,9 +16,10 @@ __author__ = 'ke4roh'
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import time
-import calendar
+import datetime
+import functools
 import logging
+import sys
 from RPiNWR.CommonMessage import CommonMessage
 
 # see http://www.nws.noaa.gov/om/vtec/
@@ -28,13 +29,38 @@ from RPiNWR.CommonMessage import CommonMessage
 _logger = logging.getLogger("RPiNWR.VTEC")
 
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+@functools.lru_cache(maxsize=1024)
 def _parse_vtec_time(str):
+    """
+    :param str: a VTEC time, yymmddThhnnZ
+    :return: seconds since the epoch, or None for 000000T0000Z (not applicable)
+    :raises ValueError: if it's not a valid time
+    """
     if str == '000000T0000Z':
         return None
-    return calendar.timegm(time.strptime(str.replace("Z", "UTC"), '%y%m%dT%H%M%Z'))
+    if len(str) != 12 or str[6] != 'T' or str[11] != 'Z' or not (str[0:6] + str[7:11]).isdigit():
+        raise ValueError(str)
+    yy = int(str[0:2])
+    # The same century as time.strptime's %y
+    year = yy + (2000 if yy < 69 else 1900)
+    when = datetime.datetime(year, int(str[2:4]), int(str[4:6]), int(str[7:9]), int(str[9:11]))
+    return (when - _EPOCH) // datetime.timedelta(seconds=1)
+
+
+def _slot_names(cls):
+    return [k for c in cls.__mro__ for k in getattr(c, '__slots__', ())]
 
 
 class VTEC(CommonMessage):
+    """
+    The common part of VTEC codes.  Two VTEC codes are equal if they have the same event, action, and times, and
+    they came from the same message (per the container's id and published time).
+    """
+    __slots__ = ('raw', 'action', 'container', 'event_id', 'start_time', 'end_time', '_key')
+
     def __init__(self, vtec, container):
         """
         :param vtec: The VTEC string, unparsed
@@ -44,12 +70,22 @@ class VTEC(CommonMessage):
         self.raw = vtec
         self.action = None
         self.container = container
-        if container is not None:
-            self.polygon = container.polygon
-            self.published = container.published
-        else:
-            self.polygon = None
-            self.published = None
+        self.event_id = None
+        self.start_time = None
+        self.end_time = None
+        self._key = None
+
+    @property
+    def polygon(self):
+        if self.container is None:
+            return None
+        return self.container.polygon
+
+    @property
+    def published(self):
+        if self.container is None:
+            return None
+        return self.container.published
 
     def __str__(self):
         return self.raw
@@ -72,12 +108,32 @@ class VTEC(CommonMessage):
     def applies_to_fips(self, fips):
         return self.container.applies_to_fips(fips)
 
+    def get_key(self):
+        """
+        :return: a tuple identifying this code, for equality and hashing
+        """
+        if self._key is None:
+            container = self.container
+            if container is None:
+                container_key = None
+            else:
+                container_key = (container.get_event_id(), container.published)
+            self._key = (type(self), self.event_id, self.action, self.start_time, self.end_time, container_key)
+        return self._key
+
     def __eq__(self, other):
-        return super(VTEC, self).__eq__(other) and self.container.get_areas() == other.container.get_areas() and \
-               self.container.published == other.container.published
+        return isinstance(other, VTEC) and self.get_key() == other.get_key()
 
-    def _fields_to_skip_for_eq(self):
-        return set(["container"])
+    def __hash__(self):
+        return hash(self.get_key())
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in _slot_names(type(self))}
+
+    def __setstate__(self, state):
+        # Codes pickled before there were slots have fields that are no longer kept
+        for k in _slot_names(type(self)):
+            setattr(self, k, state.get(k))
 
     @staticmethod
     def VTEC(vtecs, container=None):
@@ -153,12 +209,20 @@ def default_VTEC_sort(aa, bb):
 
 class PrimaryVTEC(VTEC):
     # /k.aaa.cccc.pp.s.####.yymmddThhnnZB-yymmddThhnnZE/
+    __slots__ = ('product_class', 'office_id', 'phenomenon', 'significance', 'tracking_number', 'hydrologic_vtec')
+
     def __init__(self, vtec, container=None):
         super().__init__(vtec, container)
-        self.product_class, self.action, self.office_id, self.phenomenon, self.significance, \
-        self.tracking_number, times = vtec.strip("/").split(".")
+        product_class, action, office_id, phenomenon, significance, self.tracking_number, times = \
+            vtec.strip("/").split(".")
+        # These come from short lists, so share the strings
+        self.product_class = sys.intern(product_class)
+        self.action = sys.intern(action)
+        self.office_id = sys.intern(office_id)
+        self.phenomenon = sys.intern(phenomenon)
+        self.significance = sys.intern(significance)
         self.start_time, self.end_time = [_parse_vtec_time(x) for x in times.split("-")]
-        self.event_id = vtec[7:21]
+        self.event_id = sys.intern(vtec[7:21])
         self.hydrologic_vtec = []
 
     def __lt__(self, other):
@@ -170,12 +234,25 @@ class PrimaryVTEC(VTEC):
 
 class HyrdologicVTEC(object):
     # /nwsli.s.ic.yymmddThhnnZB.yymmddThhnnZC.yymmddThhnnZE.fr/
+    __slots__ = ('raw', 'parent', 'nwsli', 'severity', 'immediate_cause', 'flood_record', 'start_time', 'crest_time',
+                 'end_time', 'event_id')
+
     def __init__(self, vtec, pvtec):
         super().__init__()
         self.raw = vtec
         self.parent = pvtec
-        self.nwsli, self.severity, self.immediate_cause, t1, t2, t3, self.flood_record = \
-            vtec.strip("/").split(".")
+        nwsli, severity, immediate_cause, t1, t2, t3, flood_record = vtec.strip("/").split(".")
+        self.nwsli = sys.intern(nwsli)
+        self.severity = sys.intern(severity)
+        self.immediate_cause = sys.intern(immediate_cause)
+        self.flood_record = sys.intern(flood_record)
         self.start_time, self.crest_time, self.end_time = \
             [_parse_vtec_time(x) for x in (t1, t2, t3)]
         self.event_id = vtec[1:24]
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        for k in self.__slots__:
+            setattr(self, k, state.get(k))
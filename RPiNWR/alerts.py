@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# Pick out alerts by type, keep the effective ones in priority order, and tell listeners when they change
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This is shared by the SAME and VTEC caches, so it must not import anything the radio driver can do without
+# (like shapely).
+import threading
+import functools
+import heapq
+import itertools
+import logging
+import time
+import re
+
+
+# The significance of SAME event codes which don't end in it
+_SAME_SIGNIFICANCE = {"TOR": "W", "SVR": "W", "EVI": "E"}
+
+
+def get_significance(event_type):
+    """
+    :param event_type: a VTEC event type like "TO.W", or a SAME event code like "TOA"
+    :return: the significance, like "W" for a warning or "A" for a watch
+    """
+    if "." in event_type:
+        return event_type[event_type.rindex(".") + 1:]
+    return _SAME_SIGNIFICANCE.get(event_type, event_type[-1:])
+
+
+class MessageFilter(object):
+    """
+    A test of messages (or EventMessageGroups) by their event type, with whatever it takes to check a type
+    compiled once, and the answer for each type remembered.  Register one with a cache to have it keep an
+    index of the messages it matches.  A message must pass every test given.
+    """
+
+    def __init__(self, event_pattern=None, event_types=None, significance=None):
+        """
+        :param event_pattern: a regular expression to match the event type, as a string or compiled
+        :param event_types: the event types to accept, like ("TOR", "SVR") or ("TO.W", "SV.W")
+        :param significance: the significance to accept (see get_significance), like "WA" for warnings and watches
+        """
+        if event_pattern is not None and not hasattr(event_pattern, 'match'):
+            event_pattern = re.compile(event_pattern)
+        self.event_pattern = event_pattern
+        self.event_types = None if event_types is None else frozenset(event_types)
+        self.significance = None if significance is None else frozenset(significance)
+        self.__answers = {}  # event type -> True if it passes
+
+    def matches_event_type(self, event_type):
+        answer = self.__answers.get(event_type, None)
+        if answer is None:
+            answer = (self.event_types is None or event_type in self.event_types) and \
+                     (self.significance is None or get_significance(event_type) in self.significance) and \
+                     (self.event_pattern is None or self.event_pattern.match(event_type) is not None)
+            self.__answers[event_type] = answer
+        return answer
+
+    def matches(self, message):
+        return self.matches_event_type(message.get_event_type())
+
+
+class AlertEvent(object):
+    """
+    The effective messages in an AlertView changed
+    """
+
+    def __init__(self, message, rank, t):
+        """
+        :param message: the message (or EventMessageGroup) that changed
+        :param rank: its place in the view's messages, 0 first - or where it was, if it was removed
+        :param t: the time as of which it changed
+        """
+        self.message = message
+        self.rank = rank
+        self.time = t
+
+    def __str__(self):
+        return "%s %d: %s" % (type(self).__name__, self.rank, str(self.message))
+
+
+class AlertAdded(AlertEvent):
+    pass
+
+
+class AlertRemoved(AlertEvent):
+    pass
+
+
+class AlertPriorityChanged(AlertEvent):
+    def __init__(self, message, old_rank, rank, t):
+        super(AlertPriorityChanged, self).__init__(message, rank, t)
+        self.old_rank = old_rank
+
+
+class AlertView(object):
+    """
+    AlertView keeps a list of the effective messages in priority order, without going through all of them
+    each time something changes.  When a message arrives, only it is considered.  Otherwise, messages only
+    change when they start or end, so a timer thread reconsiders each message at those times.
+
+    Listeners get an AlertEvent for each change.  The messages are published as a new tuple each time, so they
+    can be read from any thread.
+    """
+
+    def __init__(self, is_active, sorter, clock=time.time, timer=True):
+        """
+        :param is_active: a function taking a message and a time, True if the message is effective then
+        :param sorter: a comparator for messages, like default_SAME_sort or default_VTEC_sort
+        :param clock: a function returning the present time
+        :param timer: True to reconsider messages in a thread as time passes, False to leave it to advance
+        """
+        self.__logger = logging.getLogger(type(self).__name__)
+        self.is_active = is_active
+        self.clock = clock
+        self.messages = ()
+        self.__key = functools.cmp_to_key(sorter)
+        self.__listeners = []
+        self.__lock = threading.Condition()
+        self.__times = []  # heap of (time, sequence, message) at which to reconsider the message
+        self.__sequence = itertools.count()
+        self.stopped = False
+        if timer:
+            self.__thread = threading.Thread(target=self.__timer, daemon=True)
+            self.__thread.start()
+
+    def add_listener(self, listener):
+        """
+        :param listener: a function taking an AlertEvent
+        """
+        self.__listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.__listeners.remove(listener)
+
+    def update(self, message, times=()):
+        """
+        Consider a message which is new or has changed.
+        :param times: the times at which it could start or stop being effective
+        """
+        with self.__lock:
+            now = self.clock()
+            wake = False
+            for t in times:
+                if t is not None and t >= now:
+                    wake = wake or not self.__times or t < self.__times[0][0]
+                    heapq.heappush(self.__times, (t, next(self.__sequence), message))
+            self.__update(message, now)
+            if wake:
+                self.__lock.notify()
+
+    def discard(self, message):
+        """
+        Forget a message, which is removed if it's in the list
+        """
+        with self.__lock:
+            self.__update(message, self.clock(), False)
+
+    def advance(self, when=None):
+        """
+        Reconsider the messages which could have started or stopped by the given time
+        :param when: the time, default = the present time
+        """
+        with self.__lock:
+            self.__advance(self.clock() if when is None else when)
+
+    def __advance(self, when):
+        times = self.__times
+        due = {}
+        keep = []
+        while times and times[0][0] <= when:
+            entry = heapq.heappop(times)
+            due[id(entry[2])] = entry[2]
+            if entry[0] == when:
+                keep.append(entry)  # The end of effectiveness may be inclusive
+        for message in due.values():
+            self.__update(message, when)
+        for entry in keep:
+            heapq.heappush(times, entry)
+
+    def __update(self, message, when, active=None):
+        if active is None:
+            active = self.is_active(message, when)
+        messages = list(self.messages)
+        old = next((i for i, m in enumerate(messages) if m is message), None)
+        if old is not None:
+            del messages[old]
+        if active:
+            key = self.__key(message)
+            lo, hi = 0, len(messages)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if key < self.__key(messages[mid]):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            messages.insert(lo, message)
+            if old is None:
+                event = AlertAdded(message, lo, when)
+            elif old != lo:
+                event = AlertPriorityChanged(message, old, lo, when)
+            else:
+                event = None
+        elif old is not None:
+            event = AlertRemoved(message, old, when)
+        else:
+            return
+        self.messages = tuple(messages)
+        if event is not None:
+            for listener in self.__listeners:
+                try:
+                    listener(event)
+                except Exception:
+                    self.__logger.exception("Alert listener")
+
+    def __timer(self):
+        with self.__lock:
+            while not self.stopped:
+                now = self.clock()
+                self.__advance(now)
+                if self.__times:
+                    self.__lock.wait(min(max(self.__times[0][0] - now, 0.01), 60))
+                else:
+                    self.__lock.wait()
+
+    def close(self):
+        """
+        Stop the timer
+        """
+        with self.__lock:
+            self.stopped = True
+            self.__lock.notify()
@@ -18,14 +18,113 @@ __author__ = 'ke4roh'
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import threading
 import time
+import heapq
+import collections
+import random
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as etree
 import urllib3
 import logging
 import iso8601
 import calendar
+import datetime
+import functools
 
 _http = urllib3.PoolManager(num_pools=3)
 
+# Retry connection trouble and server errors within a poll, backing off exponentially.  Only arguments
+# urllib3 1.x takes too - the jitter is in the time between polls (see AtomEventGenerator.next_delay).
+DEFAULT_RETRIES = urllib3.Retry(total=3, backoff_factor=0.5,
+                                status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_ATOM_ENTRY = _ATOM + "entry"
+_ATOM_ID = _ATOM + "id"
+_ATOM_UPDATED = _ATOM + "updated"
+_ATOM_PUBLISHED = _ATOM + "published"
+
+
+def read_feed(source, known=(), unchanged_since=None):
+    """
+    Read an atom feed incrementally, keeping only the entries not already known.  Each entry is dropped
+    from the tree as soon as it has been read, so memory use stays flat however large the feed is.
+
+    :param source: a file name or file-like object with the feed
+    :param known: a container of entry ids which need not be kept
+    :param unchanged_since: the feed's updated time at the last reading - if it is still the same, reading stops there
+    :return: (the feed's updated time in seconds since the epoch, list of new entries, set of all entry ids),
+       or None if the feed is unchanged
+    """
+    updated = None
+    new_entries = []
+    entry_ids = set()
+    root = None
+    depth = 0
+    for event, elem in etree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        # A child of the feed is complete
+        if elem.tag == _ATOM_ENTRY:
+            entry_id = elem.find(_ATOM_ID).text
+            entry_ids.add(entry_id)
+            if entry_id not in known:
+                new_entries.append(elem)
+        elif elem.tag == _ATOM_UPDATED:
+            updated = iso8601.parse_date(elem.text).timestamp()
+            if updated == unchanged_since and not len(entry_ids):
+                return None
+        root.remove(elem)
+    return updated, new_entries, entry_ids
+
+
+def read_feed_dom(source, known=(), unchanged_since=None):
+    """
+    Read an atom feed all at once, for the same result as read_feed.  This holds the whole document
+    in memory at once.
+    """
+    root = etree.parse(source).getroot()
+    updated = iso8601.parse_date(root.find(_ATOM_UPDATED).text).timestamp()
+    if updated == unchanged_since:
+        return None
+    new_entries = []
+    entry_ids = set()
+    for entry in root.findall(_ATOM_ENTRY):
+        entry_id = entry.find(_ATOM_ID).text
+        entry_ids.add(entry_id)
+        if entry_id not in known:
+            new_entries.append(entry)
+    return updated, new_entries, entry_ids
+
+
+_MONTHS = {m: i + 1 for i, m in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+                                              'Nov', 'Dec'))}
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_http_date(date):
+    """
+    :param date: an HTTP date, like 'Wed, 25 May 2016 01:24:05 GMT'
+    :return: seconds since the epoch
+    :raises ValueError: if it's not a valid HTTP date
+    """
+    try:
+        weekday, day, month, year, hms, zone = date.split(" ")
+        hour, minute, second = hms.split(":")
+        when = datetime.datetime(int(year), _MONTHS[month], int(day), int(hour), int(minute), int(second))
+    except (ValueError, KeyError):
+        when = None
+    if when is None or zone not in ('GMT', 'UTC'):
+        # Something unusual, so let strptime have a go at it
+        return calendar.timegm(time.strptime(date, '%a, %d %b %Y %H:%M:%S %Z'))
+    return (when - _EPOCH) // datetime.timedelta(seconds=1)
+
 
 class NetStatus(object):
     def __init__(self, msg, normal=False, t=None):
@@ -42,7 +141,7 @@ class NetStatus(object):
             t += 0
         except TypeError:
             # Maybe it was a string to parse
-            t = calendar.timegm(time.strptime(t.strip(), '%a, %d %b %Y %H:%M:%S %Z'))
+            t = _parse_http_date(t.strip())
         self.time = t
 
     def __str__(self):
@@ -74,10 +173,32 @@ class DeletedAtomEntry(object):
 class AtomEventGenerator(object):
     """
     This class polls an atom feed and calls the callback for every new item
-    observed.
+    observed.  Polls are conditional GETs (If-None-Match/If-Modified-Since), and a feed whose
+    <updated> time has not changed is not examined further, so polling often is cheap.
+
+    Network trouble never stops the polling.  Failed polls are retried with exponential backoff, and after
+    breaker_threshold failures in a row the circuit opens: a NetStatus says so, and the feed is only tried
+    every max_backoff_sec until it answers.  Then the status goes back to OK and polling to its usual pace.
     """
 
-    def __init__(self, url, callback, polling_interval_sec=60, persistence_sec=600):
+    def __init__(self, url, callback, polling_interval_sec=60, persistence_sec=600, streaming=True,
+                 manager=None, max_backoff_sec=900, connect_timeout_sec=10, read_timeout_sec=30,
+                 retries=DEFAULT_RETRIES, breaker_threshold=5, state_store=None):
+        """
+        :param url: The atom feed to poll
+        :param callback: a function to receive NetStatus, NewAtomEntry, and DeletedAtomEntry events
+        :param polling_interval_sec: how long to wait between polls
+        :param persistence_sec: how long to remember an entry after it disappears from the feed
+        :param streaming: True to read the feed with read_feed, False to read it with read_feed_dom
+        :param manager: an AtomFeedManager to do the polling, or None to poll on a thread of its own
+        :param max_backoff_sec: the longest to wait between polls while the feed is failing
+        :param connect_timeout_sec: how long to wait for a connection
+        :param read_timeout_sec: how long to wait for the server to send something
+        :param retries: a urllib3.Retry (or number of retries) for each poll
+        :param breaker_threshold: how many polls in a row must fail to open the circuit
+        :param state_store: a StateStore to resume from and keep up to date, so that a restart does not report
+           entries already seen, or None to start from scratch
+        """
         self.__logger = logging.getLogger(self.__class__.__name__)
         self.status = NetStatus("starting", True)
         self.url = url
@@ -87,60 +208,184 @@ class AtomEventGenerator(object):
         self.updated = None
         self.next_poll_time = 0
         self.persistence = persistence_sec
+        self.max_backoff = max_backoff_sec
+        self.failures = 0  # consecutive failed polls
+        self.timeout = urllib3.Timeout(connect=connect_timeout_sec, read=read_timeout_sec)
+        self.retries = retries
+        self.breaker_threshold = breaker_threshold
+        self.circuit_open = False
+        # Every entry id in the feed maps to None, and ids which have left it (but not for persistence_sec) map
+        # to the generation (feed revision) in which they left.
         self.id_cache = {}
-        self.__thread = threading.Thread(target=self.__poller, daemon=True)
-        self.__thread.start()
+        self.generation = 0
+        self.__present = set()
+        self.__departures = collections.deque()  # (last seen, generation, id), oldest first
+        # What came, went, or was forgotten since the state was last saved
+        self.__unsaved = {}  # id -> (generation or None, last seen)
+        self.__forgotten = set()
+        self.read_feed = read_feed if streaming else read_feed_dom
+        # Validators from the last good response, for a conditional GET
+        self.etag = None
+        self.last_modified = None
+        self.state_store = state_store
+        if state_store is not None:
+            self.__restore(state_store.load_feed(url))
+        if manager is None:
+            self.http = _http
+            self.__thread = threading.Thread(target=self.__poller, daemon=True)
+            self.__thread.start()
+        else:
+            self.http = manager.http
+            manager.add(self)
 
     def __poller(self):
         while not self.stop:
+            self.poll()
+            self.next_poll_time = time.time() + self.next_delay()
+            while not self.stop and time.time() < self.next_poll_time:
+                time.sleep(max(0, min(0.5, self.next_poll_time - time.time())))
+
+    def next_delay(self):
+        """
+        :return: seconds to wait before the next poll, backing off exponentially (with jitter) while the feed
+           is failing
+        """
+        if self.circuit_open:
+            backoff = self.max_backoff
+        elif self.failures:
+            backoff = min(self.max_backoff, self.polling_interval_sec * 2 ** self.failures)
+        else:
+            return self.polling_interval_sec
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def poll(self):
+        """
+        Poll the feed once, firing events for whatever has changed.  Polls of one feed must not overlap.
+
+        :return: True if the poll succeeded
+        """
+        try:
             self.__poll()
-            self.next_poll_time = time.time() + self.polling_interval_sec
-            while time.time() < self.next_poll_time:
-                time.sleep(min(0.5, time.time() + self.next_poll_time))
+        except Exception as e:
+            self.__logger.exception("Polling " + self.url)
+            self.__fail(str(e))
+        if self.status.normal:
+            self.failures = 0
+            self.circuit_open = False
+        else:
+            self.failures += 1
+            if not self.circuit_open and self.failures >= self.breaker_threshold:
+                self.circuit_open = True
+                self.__set_status(NetStatus("Circuit open after %d failures: %s" % (self.failures, self.status.msg)))
+        return self.status.normal
+
+    def __fail(self, msg):
+        """
+        Report a failed poll.  While the circuit is open, this is no news.
+        """
+        if self.circuit_open:
+            msg = self.status.msg
+        self.__set_status(NetStatus(msg))
+
+    def __restore(self, state):
+        if state is None:
+            return
+        self.etag, self.last_modified, self.updated, self.generation = state
+        for entry_id, generation, last_seen in self.state_store.load_feed_entries(self.url):
+            self.id_cache[entry_id] = generation
+            if generation is None:
+                self.__present.add(entry_id)
+            else:
+                self.__departures.append((last_seen, generation, entry_id))
+
+    def __save(self):
+        """
+        Save the validators and such, and only the entries that changed since the last time
+        """
+        if self.state_store is not None:
+            self.state_store.save_feed(self.url, (self.etag, self.last_modified, self.updated, self.generation),
+                                       [(entry_id,) + e for entry_id, e in self.__unsaved.items()],
+                                       self.__forgotten)
+        self.__unsaved = {}
+        self.__forgotten = set()
+
+    def __request_headers(self):
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
 
     def __poll(self):
-        # TODO what happens if HTTP error/timeout?
-        r = _http.urlopen('GET', self.url, preload_content=False)
+        try:
+            r = self.http.urlopen('GET', self.url, headers=self.__request_headers(), preload_content=False,
+                                  timeout=self.timeout, retries=self.retries)
+        except urllib3.exceptions.HTTPError as e:
+            self.__logger.warning("Polling %s: %s" % (self.url, e))
+            self.__fail(str(e))
+            return
+        if r.status == 304:
+            # Nothing has changed since the last time
+            r.release_conn()
+            self.__set_status(NetStatus("OK", True, t=r.headers.get('Date')))
+            self.last_successful_poll = self.status.time
+            return
         if r.status != 200:
-            self.__set_status(NetStatus(r.status))
+            r.drain_conn()
+            r.release_conn()
+            self.__fail("HTTP %d %s" % (r.status, r.reason))
             return
         try:
-            root = etree.parse(r).getroot()
+            feed = self.read_feed(r, self.id_cache, self.updated)
         except Exception as e:
-            self.__set_status(NetStatus(str(e)))
             self.__logger.exception("net woes")
+            self.__fail(str(e))
             return
+        finally:
+            # read_feed may stop early; finish reading so the connection can be reused
+            r.drain_conn()
+            r.release_conn()
 
-        self.__set_status(NetStatus("OK", True, t=r.headers['Date']))
+        self.__set_status(NetStatus("OK", True, t=r.headers.get('Date')))
+        self.etag = r.headers.get('ETag')
+        self.last_modified = r.headers.get('Last-Modified')
         self.last_successful_poll = self.status.time
         http_time_now = self.status.time
-        updated = iso8601.parse_date(root.find("{http://www.w3.org/2005/Atom}updated").text).timestamp()
+        if feed is None:
+            # The server sent it again, but the feed says it hasn't changed
+            self.__save()
+            return
+        updated, new_messages, entry_ids = feed
+        last_seen = self.updated
         self.updated = updated
+        self.generation += 1
 
-        missing = dict(self.id_cache)
-        new_messages = []
-        for entry in root.findall('{http://www.w3.org/2005/Atom}entry'):
-            entry_id = entry.find('{http://www.w3.org/2005/Atom}id').text
-            if entry_id in self.id_cache:
-                missing.pop(entry_id)
-            else:
-                new_messages.append(entry)
-                self.id_cache[entry_id] = updated
+        # Only ids which came or went need any attention
+        for entry_id in entry_ids - self.__present:
+            self.id_cache[entry_id] = None
+            self.__unsaved[entry_id] = (None, None)
+            self.__forgotten.discard(entry_id)
+        for entry_id in self.__present - entry_ids:
+            self.id_cache[entry_id] = self.generation
+            self.__departures.append((last_seen, self.generation, entry_id))
+            self.__unsaved[entry_id] = (self.generation, last_seen)
+        self.__present = entry_ids
 
         # Events need to fire in order so that they are processed in order
-        for msg in sorted(new_messages, key=lambda x: iso8601.parse_date(
-                x.find('{http://www.w3.org/2005/Atom}published').text).timestamp()):
+        for msg in sorted(new_messages, key=lambda x: iso8601.parse_date(x.find(_ATOM_PUBLISHED).text).timestamp()):
             self.callback(NewAtomEntry(msg, http_time_now))
 
-        # Clear the cache of entries that have gone away
-        for entry_id, entry in missing.items():
-            if self.id_cache[entry_id] + self.persistence <= updated:
-                self.id_cache.pop(entry_id)
+        # Forget entries that have been gone long enough
+        departures = self.__departures
+        while len(departures) and departures[0][0] + self.persistence <= updated:
+            last_seen, generation, entry_id = departures.popleft()
+            if self.id_cache.get(entry_id) == generation:  # It didn't come back
+                del self.id_cache[entry_id]
+                self.__unsaved.pop(entry_id, None)
+                self.__forgotten.add(entry_id)
                 self.callback(DeletedAtomEntry(entry_id, http_time_now))
-
-        # Keep the cache of remaining entries alive
-        for entry_id in self.id_cache.keys():
-            self.id_cache[entry_id] = updated
+        self.__save()
 
     def __set_status(self, status):
         """
@@ -151,3 +396,84 @@ class AtomEventGenerator(object):
         self.status = status
         if old_status.msg != status.msg or old_status.normal != status.normal:
             self.callback(status)
+
+
+class AtomFeedManager(object):
+    """
+    Poll many feeds from one scheduler thread and a small pool of workers, sharing keep-alive connections.
+    Each feed is polled by one worker at a time, so its callbacks come in order.  Poll times get a little
+    random jitter so that feeds on the same interval don't all hit the network at once.
+
+    To use it, pass it as the manager for each AtomEventGenerator.  Set stop on a generator to drop it.
+    """
+
+    def __init__(self, workers=4, jitter=0.1, http=None):
+        """
+        :param workers: how many feeds may be polled at the same time
+        :param jitter: the fraction by which poll intervals are randomly lengthened or shortened
+        :param http: a urllib3.PoolManager to share among the feeds, None for one sized to the workers
+        """
+        if http is None:
+            http = urllib3.PoolManager(num_pools=10, maxsize=workers)
+        self.http = http
+        self.jitter = jitter
+        self.stopped = False
+        self.__schedule = []  # heap of (time, sequence, feed)
+        self.__sequence = 0
+        self.__lock = threading.Condition()
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__logger = logging.getLogger(type(self).__name__)
+        self.__thread = threading.Thread(target=self.__scheduler, daemon=True)
+        self.__thread.start()
+
+    def add(self, feed):
+        """
+        Schedule a feed to be polled, within a fraction of its interval from now.
+        """
+        self.__enqueue(feed, time.time() + random.uniform(0, self.jitter * feed.polling_interval_sec))
+
+    def __enqueue(self, feed, when):
+        with self.__lock:
+            heapq.heappush(self.__schedule, (when, self.__sequence, feed))
+            self.__sequence += 1
+            self.__lock.notify()
+
+    def __scheduler(self):
+        with self.__lock:
+            while not self.stopped:
+                if not len(self.__schedule):
+                    self.__lock.wait()
+                    continue
+                remaining = self.__schedule[0][0] - time.time()
+                if remaining > 0:
+                    self.__lock.wait(remaining)
+                    continue
+                feed = heapq.heappop(self.__schedule)[2]
+                if not feed.stop:
+                    self.__executor.submit(self.__poll, feed)
+
+    def __poll(self, feed):
+        try:
+            feed.poll()
+        except Exception:
+            feed.failures += 1
+            self.__logger.exception("Polling " + feed.url)
+        if not (feed.stop or self.stopped):
+            delay = feed.next_delay() * random.uniform(1 - self.jitter, 1 + self.jitter)
+            self.__enqueue(feed, time.time() + delay)
+
+    def shutdown(self):
+        """
+        Stop polling, and wait for polls in progress to finish.
+        """
+        with self.__lock:
+            self.stopped = True
+            self.__lock.notify()
+        self.__thread.join()
+        self.__executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
@@ -18,9 +18,13 @@ __author__ = 'ke4roh'
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import threading
 import functools
+import bisect
+import heapq
+import logging
 import time
 import re
 from shapely.geometry import Point
+from RPiNWR.alerts import AlertView
 
 
 class MessageCache(object):
@@ -31,55 +35,240 @@ class MessageCache(object):
     0. Know its county
     1. Receive SAME messages
     3. Provide a list of effective messages for a specific county in priority order
-    4. Clear out inactive messages upon request
+    4. Clear out expired messages upon request, or every so often in the background
+    5. Tell subscribers when the effective messages change
+    6. Keep an index of the events matching each registered MessageFilter
 
     Collaborators:
     A message source, either Si4707 or other message retriever
     A consumer, to monitor the messages
+
+    Readers never wait on the lock.  The events are held in a dict which is never changed once it is published;
+    a writer copies it, changes the copy, and puts that in its place.  The same goes for the messages within
+    each event (see EventMessageGroup).
     """
 
     # TODO track the time since last received message for my fips, alert if >8 days
     # TODO monitor RSSI & SNR and alert if out of spec (what is spec)?
-    def __init__(self, latlon, county_fips, sorter):
+    def __init__(self, latlon, county_fips, sorter, state_store=None, sweep_interval_sec=None, sweep_batch=50):
+        """
+        :param latlon: (latitude, longitude) of the place of interest
+        :param county_fips: the county containing it
+        :param sorter: a comparator for messages, like default_SAME_sort or default_VTEC_sort
+        :param state_store: a StateStore to keep messages in, so they don't have to be received or parsed
+           again after a restart, or None
+        :param sweep_interval_sec: how often to clear out expired messages in a background thread, at most,
+           or None to leave that to whoever calls clear_inactive
+        :param sweep_batch: how many events to drop at a time while holding the lock
+        """
+        self.__logger = logging.getLogger(type(self).__name__)
         self.__messages_lock = threading.Lock()
-        self.__messages = {}
+        self.__messages = {}  # event_id -> EventMessageGroup, replaced whole, never changed
+        self.__ends = {}  # event_id -> the latest end time of its messages, or None until further notice
+        self.__expiry = []  # heap of (end time, event_id), some stale after later messages extend the event
         self.__local_messages = []
         self.latlon = latlon
         self.county_fips = county_fips
         self.sorter = sorter
-        # TODO add cleanup daemon thread to sweep every so often for expired messages
+        self.state_store = None
+        self.sweep_batch = sweep_batch
+        self.evicted = 0  # events cleared out since the start
+        self.__views = {}  # here -> AlertView
+        self.__indexes = {}  # filter name -> (MessageFilter, {event_id: EventMessageGroup}), replaced whole
+        if state_store is not None:
+            for message in state_store.load_messages():
+                self.add_message(message)
+            self.state_store = state_store
+        self.__stop = threading.Event()
+        if sweep_interval_sec is not None:
+            self.__sweeper = threading.Thread(target=self.__sweep, args=(sweep_interval_sec,), daemon=True)
+            self.__sweeper.start()
 
     def add_message(self, message):
+        end = message.get_end_time_sec()
         with self.__messages_lock:
-            collection = self.__messages
-            if message.event_id not in collection:
+            holder = self.__messages.get(message.event_id, None)
+            if holder is None:
                 holder = EventMessageGroup()
+                added = holder.add_message(message)
+                collection = dict(self.__messages)
                 collection[message.event_id] = holder
+                self.__messages = collection
             else:
-                holder = collection[message.event_id]
-            holder.add_message(message)
+                added = holder.add_message(message)
+            if added:
+                self.__expire(message.event_id, end)
+                expires = self.__ends[message.event_id]
+                self.__index(message.event_id, holder)
+                for view in self.__views.values():
+                    view.update(holder, _transition_times(message))
+        if added and self.state_store is not None:
+            self.state_store.save_message(message, expires)
+
+    def __expire(self, event_id, end):
+        """
+        Take note of the end time of a message for the event.  Call with the lock held.
+        :param end: the end time of the message, or None if it goes on until further notice
+        """
+        if event_id in self.__ends:
+            latest = self.__ends[event_id]
+            if end is not None and latest is not None and end <= latest:
+                return  # It will be there until at least the time already noted
+        # None cancels any expiry on the heap, as its entry no longer matches
+        self.__ends[event_id] = end
+        if end is not None:
+            heapq.heappush(self.__expiry, (end, event_id))
+
+    def __index(self, event_id, holder):
+        """
+        Bring the filters' indexes up to date for one event.  Call with the lock held.
+        :param holder: the EventMessageGroup, or None if it's gone
+        """
+        indexes = None
+        for name, (message_filter, index) in self.__indexes.items():
+            matched = holder is not None and message_filter.matches(holder)
+            if matched != (event_id in index):
+                index = dict(index)
+                if matched:
+                    index[event_id] = holder
+                else:
+                    del index[event_id]
+                if indexes is None:
+                    indexes = dict(self.__indexes)
+                indexes[name] = (message_filter, index)
+        if indexes is not None:
+            self.__indexes = indexes
 
-    def get_active_messages(self, when=None, event_pattern=None, here=True):
+    def add_filter(self, name, message_filter):
+        """
+        Register a filter, so that get_active_messages can go straight to the events it matches
+        :param name: the name by which to ask for it
+        :param message_filter: a MessageFilter
+        """
+        with self.__messages_lock:
+            indexes = dict(self.__indexes)
+            indexes[name] = (message_filter,
+                             {k: g for k, g in self.__messages.items() if message_filter.matches(g)})
+            self.__indexes = indexes
+
+    def get_active_messages(self, when=None, event_pattern=None, here=True, filter_name=None):
         """
         :param when: the time for which to check effectiveness of the messages, default = the present time
         :param event_pattern: a regular expression to match the desired event codes.  default = all.
         :param here: True to retrieve local messages, False to retrieve those for other locales
+        :param filter_name: the name of a filter given to add_filter, to consider only the events it matches
         """
         if when is None:
             when = time.time()
-        if event_pattern is None:
-            event_pattern = re.compile(".*")
-        elif not hasattr(event_pattern, 'match'):
+        if event_pattern is not None and not hasattr(event_pattern, 'match'):
             event_pattern = re.compile(event_pattern)
 
-        l = list(filter(lambda m: m.is_effective(self.latlon, self.county_fips, here, when) and event_pattern.match(
-            m.get_event_type()), self.__messages.values()))
+        if filter_name is None:
+            groups = self.__messages.values()
+        else:
+            groups = self.__indexes[filter_name][1].values()
+        l = list(filter(lambda m: m.is_effective(self.latlon, self.county_fips, here, when) and (
+            event_pattern is None or event_pattern.match(m.get_event_type())), groups))
         l.sort(key=functools.cmp_to_key(self.sorter))
         return l
 
     def clear_inactive(self, when=None):
+        """
+        Clear out the events which have ended, a batch at a time so as not to hold up anything else
+        :param when: the time by which they must have ended, default = the present time
+        :return: how many events were cleared out
+        """
+        if when is None:
+            when = time.time()
+        count = 0
+        while True:
+            with self.__messages_lock:
+                batch = self.__evict(when, self.sweep_batch)
+                self.evicted += batch
+            if not batch:
+                break
+            count += batch
+        if count:
+            self.__logger.debug("Cleared out %d events, %d remain" % (count, len(self.__messages)))
+        if self.state_store is not None:
+            self.state_store.forget_messages(when)
+        return count
+
+    def __evict(self, when, limit):
+        """
+        Drop up to limit events which ended by the given time.  Call with the lock held.
+        :return: how many were dropped
+        """
+        expiry = self.__expiry
+        collection = None
+        count = 0
+        while count < limit and expiry and expiry[0][0] <= when:
+            end, event_id = heapq.heappop(expiry)
+            if self.__ends.get(event_id, None) == end:  # otherwise it was extended or already gone
+                if collection is None:
+                    collection = dict(self.__messages)
+                for view in self.__views.values():
+                    view.discard(collection[event_id])
+                self.__index(event_id, None)
+                del collection[event_id]
+                del self.__ends[event_id]
+                count += 1
+        if collection is not None:
+            self.__messages = collection
+        return count
+
+    def __sweep(self, interval):
+        while not self.__stop.is_set():
+            try:
+                self.clear_inactive()
+            except Exception:
+                self.__logger.exception("Clearing out expired messages")
+            with self.__messages_lock:
+                wait = interval if not self.__expiry else min(interval, self.__expiry[0][0] - time.time())
+            self.__stop.wait(max(wait, 0.01))
+
+    def subscribe(self, listener, here=True):
+        """
+        :param listener: a function taking an AlertEvent, called each time the effective events change.  It's
+           called with locks held, so it must not add messages itself.
+        :param here: True to hear about local events, False for those for other locales
+        :return: the AlertView, whose messages are the effective events (EventMessageGroups) in priority order
+        """
         with self.__messages_lock:
-            self.__messages = self.get_active_messages(when)
+            view = self.__views.get(here, None)
+            if view is None:
+                view = AlertView(lambda g, when: g.is_effective(self.latlon, self.county_fips, here, when), self.sorter)
+                for group in self.__messages.values():
+                    view.update(group, [t for m in group.messages for t in _transition_times(m)])
+                self.__views[here] = view
+        view.add_listener(listener)
+        return view
+
+    def unsubscribe(self, listener, here=True):
+        view = self.__views.get(here, None)
+        if view is not None:
+            view.remove_listener(listener)
+
+    def close(self):
+        """
+        Stop clearing out expired messages in the background, and stop the subscriptions' timers
+        """
+        self.__stop.set()
+        for view in self.__views.values():
+            view.close()
+
+
+def _transition_times(message):
+    """
+    :return: the times at which the message could make its event start or stop being effective
+    """
+    return message.published, message.get_start_time_sec(), message.get_end_time_sec()
+
+
+# VTEC actions after which the event is over for the areas in the message.  The rest (NEW, CON, EXT, EXA, EXB,
+# COR, ROU) leave it in effect per the message, until its end time.  EXP is sent a few minutes ahead of the
+# end time, so it's in that second group.  SAME messages have no action, so they're all like NEW.
+_ENDING_ACTIONS = frozenset(('CAN', 'UPG'))
 
 
 class EventMessageGroup(object):
@@ -87,20 +276,98 @@ class EventMessageGroup(object):
     Responsibilities:
     Store messages with VTEC codes by their geos
     split them by their geos to find status by geo
+
+    Each message is folded into a timeline for each of its areas as it arrives, so the state of an area at any
+    time is the latest message published by then (or nothing, if that message ended the event there).
+
+    Adding a message replaces the lists, sets and dicts rather than changing them, so it's safe to read from other
+    threads while one adds (but only one may add at a time).
     """
 
     def __init__(self):
         self.messages = []
         self.areas = set([])
+        self.__keys = set()  # of the messages, to spot duplicates
+        self.__timelines = {}  # area -> [(published, sequence, message or None if ended)] in order
+        self.__counties = {}  # county (FIPS without the P digit) -> its areas in the timelines
 
     def add_message(self, msg):
+        """
+        :return: True if the message was added, False if it was already here
+        """
         if len(self.messages):
             assert msg.event_id == self.get_event_id()
-            if msg in self.messages:
-                return
-        self.messages.append(msg)
-        self.areas.update(msg.get_areas())
+        key = msg.get_key()
+        if key in self.__keys:
+            return False
+        self.__keys.add(key)
+        self.__fold(msg)
+        self.messages = self.messages + [msg]
+        self.areas = self.areas.union(msg.get_areas())
         # Maybe handle corrections by replacing, maybe just leave them in as historical record
+        return True
+
+    def __fold(self, msg):
+        """
+        Record the message as the state of each of its areas from the time it was published
+        """
+        if getattr(msg, 'action', None) in _ENDING_ACTIONS:
+            state = None
+        else:
+            state = msg
+        entry = (msg.published, len(self.messages), state)
+        timelines = dict(self.__timelines)
+        counties = None
+        for area in msg.get_areas():
+            if len(area) == 5:
+                area = '0' + area
+            timeline = timelines.get(area)
+            if timeline is None:
+                timelines[area] = [entry]
+                if counties is None:
+                    counties = dict(self.__counties)
+                counties[area[1:]] = counties.get(area[1:], frozenset()) | {area}
+            elif timeline[-1] < entry:
+                timelines[area] = timeline + [entry]
+            else:
+                timeline = list(timeline)
+                bisect.insort(timeline, entry)  # It arrived late
+                timelines[area] = timeline
+        # The timelines first, so that every area a reader finds by county is in them
+        self.__timelines = timelines
+        if counties is not None:
+            self.__counties = counties
+
+    def __areas(self, fips):
+        """
+        :return: the areas in the timelines which fips refers to (see SAMEMessage.applies_to_fips)
+        """
+        if len(fips) == 5:
+            fips = '0' + fips
+        if fips[0] == '0':
+            return self.__counties.get(fips[1:], ())
+        return [a for a in (fips, '0' + fips[1:]) if a in self.__timelines]
+
+    def __state(self, area, when):
+        """
+        :return: the timeline entry in effect for the area at the given time, or None if nothing is
+        """
+        timeline = self.__timelines[area]
+        if timeline[-1][0] <= when:
+            entry = timeline[-1]
+        else:
+            i = bisect.bisect_right(timeline, (when, float("inf"))) - 1
+            if i < 0:
+                return None
+            entry = timeline[i]
+        m = entry[2]
+        if m is None:
+            return None
+        start = m.get_start_time_sec()
+        end = m.get_end_time_sec()
+        if (start is None or start <= when) and (end is None or when < end):
+            return entry
+        return None
 
     def get_event_id(self):
         if len(self.messages):
@@ -134,18 +401,16 @@ class EventMessageGroup(object):
         else:
             when + 0  # fail if it's not numeric
 
-        # Get all the messages for the county
+        # Get the state of each area of the county
         # TODO make this work if they're zones, too.
-        cm = list(filter(lambda m: m.applies_to_fips(fips) and m.published <= when and
-                                   (m.get_end_time_sec() > when and
-                                    (m.get_start_time_sec() is None or m.get_start_time_sec() <= when)), self.messages))
+        states = [e for e in (self.__state(a, when) for a in self.__areas(fips)) if e is not None]
 
         # If it has a polygon, does it apply here?
-        its_here = len(cm)
+        its_here = len(states)
         polygon = None
         if its_here and latlon:
             try:
-                polygon = cm[-1].container.polygon
+                polygon = max(states)[2].container.polygon
             except AttributeError:
                 polygon = None
 
@@ -31,6 +31,9 @@ _CONTEXTS = ["RPiNWR.Si4707.mock.MockContext"]
 try:
     from RPiNWR.AIWIBoardContext import AIWIBoardContext
 
+    _CONTEXTS.append("RPiNWR.AIWIBoardContext.AIWIBoardI2CDevContext")
+    import Adafruit_GPIO.I2C
+
     _CONTEXTS.append("RPiNWR.AIWIBoardContext.AIWIBoardContext")
 except ImportError:
     pass  # It's not a valid choice in this environment
@@ -77,6 +80,11 @@ class Radio(object):
         message_logger.addHandler(message_log_handler)
 
         # Since this is logging lots of things, best to not also log every time we check for status
+        if getattr(self.args.hardware_context, "chatty_i2c", False):
+            Radio._quiet_i2c_logging()
+
+    @staticmethod
+    def _quiet_i2c_logging():
         try:
             import Adafruit_GPIO.I2C as i2c
 
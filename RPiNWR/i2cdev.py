@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# Talk to the Si4707 through the Linux i2c-dev interface, without any libraries in between
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Ref https://www.kernel.org/doc/Documentation/i2c/dev-interface
+# This is the same I2C_RDWR ioctl that smbus2's i2c_rdwr uses, done with ctypes so there is nothing to install.
+
+import ctypes
+import fcntl
+from RPiNWR.Si4707 import Context
+
+# From linux/i2c-dev.h and linux/i2c.h
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+
+_MAX_TRANSFER = 32
+
+
+class _I2CMsg(ctypes.Structure):
+    _fields_ = [("addr", ctypes.c_uint16),
+                ("flags", ctypes.c_uint16),
+                ("len", ctypes.c_uint16),
+                ("buf", ctypes.POINTER(ctypes.c_uint8))]
+
+
+class _I2CRdwrIoctlData(ctypes.Structure):
+    _fields_ = [("msgs", ctypes.POINTER(_I2CMsg)),
+                ("nmsgs", ctypes.c_uint32)]
+
+
+class I2CDevice(object):
+    """
+    One device on an i2c-dev bus.  Every transfer is a single I2C_RDWR ioctl, and the ioctl structures
+    and buffers are allocated once, up front.
+
+    Writes and reads are separate transfers.  The Si4707 has to be polled for CTS between taking a command and
+    giving its response, so reading in the same transaction as the write (with a repeated start) would be too soon.
+
+    This class is not thread-safe.
+    """
+
+    def __init__(self, address, bus=1, device=None, ioctl=fcntl.ioctl):
+        """
+        :param address: the 7-bit I2C address of the device
+        :param bus: the number of the bus, as in /dev/i2c-1
+        :param device: an open /dev/i2c-* file (or stand-in), None to open the one for the bus
+        :param ioctl: the function to issue the ioctl, like fcntl.ioctl (replaceable for testing)
+        """
+        if device is None:
+            device = open("/dev/i2c-%d" % bus, "r+b", buffering=0)
+        self.address = address
+        self.device = device
+        self.__ioctl = ioctl
+        self.__write_buffer = (ctypes.c_uint8 * _MAX_TRANSFER)()
+        self.__read_buffer = (ctypes.c_uint8 * _MAX_TRANSFER)()
+        self.__write_view = memoryview(self.__write_buffer).cast('B')
+        self.__read_view = memoryview(self.__read_buffer).cast('B')
+        self.__msg = _I2CMsg()
+        self.__rdwr = _I2CRdwrIoctlData(ctypes.pointer(self.__msg), 1)
+
+    def __set_write(self, msg, data):
+        n = len(data)
+        if not 0 < n <= _MAX_TRANSFER:
+            raise ValueError("%d bytes" % n)
+        self.__write_view[0:n] = data
+        msg.addr = self.address
+        msg.flags = 0
+        msg.len = n
+        msg.buf = self.__write_buffer
+
+    def __set_read(self, msg, n):
+        if not 0 < n <= _MAX_TRANSFER:
+            raise ValueError("%d bytes" % n)
+        msg.addr = self.address
+        msg.flags = I2C_M_RD
+        msg.len = n
+        msg.buf = self.__read_buffer
+
+    def __transfer(self):
+        self.__ioctl(self.device.fileno(), I2C_RDWR, self.__rdwr)
+
+    def write(self, data):
+        """
+        :param data: bytes-like, up to 32 bytes
+        """
+        self.__set_write(self.__msg, data)
+        self.__transfer()
+
+    def read_into(self, buf):
+        """
+        :param buf: a writable buffer of up to 32 bytes, to be filled
+        :return: the number of bytes read
+        """
+        n = len(buf)
+        self.__set_read(self.__msg, n)
+        self.__transfer()
+        buf[0:n] = self.__read_view[0:n]
+        return n
+
+    def close(self):
+        self.device.close()
+
+
+class I2CDevContext(Context):
+    """
+    A Context for an Si4707 on an i2c-dev bus.  Transfers go straight to the kernel, and none of them
+    are logged, so routine status checks make no noise.
+
+    Resetting the chip is not a matter for the bus, so this only resets if it is given a way to do so.
+    See AIWIBoardI2CDevContext for the AIWI board.
+    """
+
+    def __init__(self, address=0x11, bus=1, device=None, ioctl=fcntl.ioctl, reset=None):
+        """
+        :param address: the Si4707's I2C address
+        :param bus: the number of the bus, as in /dev/i2c-1
+        :param device: an open /dev/i2c-* file (or stand-in), None to open the one for the bus
+        :param ioctl: the function to issue the ioctl (replaceable for testing)
+        :param reset: a function to reset the chip, or None if there is none
+        """
+        super(I2CDevContext, self).__init__()
+        self.i2c_device = I2CDevice(address, bus, device, ioctl)
+        self.reset = reset
+
+    def reset_radio(self):
+        if self.reset is not None:
+            self.reset()
+
+    def write_bytes(self, data):
+        self.i2c_device.write(data)
+
+    def read_into(self, buf):
+        return self.i2c_device.read_into(buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.i2c_device.close()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# Decode archived SAME headers again, as after a change to average_message, and see what changed
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The archive has one JSON object per line, as from SAMEMessage.to_dict, which names the transmitter (null if it
+# wasn't known - give --transmitter for those):
+#   {"headers": [[header, confidence, time], ...], "time": ..., "transmitter": "WXL58", ...}
+# The output is the same, line for line, with "message" and "confidence" decoded afresh (or "error" if that
+# failed), so it can serve as the previous run the next time.
+#
+#   python3 -m RPiNWR.redecode archive.jsonl -o decoded.jsonl --previous last.jsonl --report changes.txt
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from RPiNWR.SAME import average_message
+
+
+def decode_record(record, transmitter=None):
+    """
+    :param record: a dict like SAMEMessage.to_dict makes, with the headers
+    :param transmitter: the transmitter, if the record doesn't say
+    :return: the record with the message and confidence decoded from the headers
+    """
+    record = dict(record)
+    record.pop("error", None)
+    try:
+        record["message"], record["confidence"] = average_message(
+            record["headers"], record.get("transmitter") or transmitter)
+    except Exception as e:
+        record["message"] = record["confidence"] = None
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+    return record
+
+
+def _decode_lines(lines, transmitter):
+    """
+    Decode a chunk of the archive, in a worker process
+    :return: the output lines
+    """
+    return [json.dumps(decode_record(json.loads(line), transmitter), ensure_ascii=False) for line in lines]
+
+
+def redecode(lines, transmitter=None, workers=None, chunk_size=100):
+    """
+    Decode archived headers across processes, a chunk at a time, with only a few chunks in hand at once.
+    :param lines: the archive, one JSON object per line (blank lines are skipped)
+    :param transmitter: the transmitter, for records that don't say
+    :param workers: how many processes, default = one per CPU
+    :param chunk_size: how many records to send to a process at a time
+    :return: a generator of output lines (without line endings), in the order of the input
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    lines = (line for line in lines if line.strip())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if chunk:
+                pending.append(executor.submit(_decode_lines, chunk, transmitter))
+            if pending and (not chunk or len(pending) >= 2 * workers):
+                for out in pending.popleft().result():
+                    yield out
+            elif not chunk:
+                break
+
+
+class DiffReport(object):
+    """
+    A tally of how this run's messages differ from those of a previous run, record by record
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.messages_changed = []  # (record number from 1, old message, new message)
+        self.confidence_changed = 0  # records with the same message as before, but not the same confidence
+        self.errors = 0
+        self.removed = 0  # records of the previous run past the end of this one
+
+    def compare(self, old, new):
+        """
+        :param old: the record from the previous run, or None if it had fewer
+        :param new: the record from this run, or None if the previous run had more
+        """
+        old_message = None if old is None else old.get("message")
+        if new is None:
+            self.removed += 1
+            self.messages_changed.append((self.records + self.removed, old_message, None))
+            return
+        self.records += 1
+        if new.get("error"):
+            self.errors += 1
+        if old_message != new["message"]:
+            self.messages_changed.append((self.records, old_message, new["message"]))
+        elif old is not None and old.get("confidence") != new["confidence"]:
+            self.confidence_changed += 1
+
+    def write(self, out):
+        for n, old, new in self.messages_changed:
+            out.write("%d:\n  - %s\n  + %s\n" % (n, old, new))
+        out.write("%d records, %d messages changed, %d confidences changed, %d errors, %d removed\n" % (
+            self.records, len(self.messages_changed), self.confidence_changed, self.errors, self.removed))
+
+
+def main(args=None):
+    clparser = argparse.ArgumentParser(description="Decode archived SAME headers again.")
+    clparser.add_argument("archive", help="JSON lines of SAMEMessage.to_dict, - for standard input")
+    clparser.add_argument("-o", "--output", default="-", help="where to write the decoded records")
+    clparser.add_argument("--transmitter", default=None, help="for records that don't name their transmitter")
+    clparser.add_argument("--previous", default=None, help="the output of a previous run to compare")
+    clparser.add_argument("--report", default="-", help="where to write the comparison")
+    clparser.add_argument("--workers", default=None, type=int)
+    clparser.add_argument("--chunk-size", default=100, type=int)
+    args = clparser.parse_args(args)
+
+    def open_or(name, mode, default):
+        return default if name == "-" else open(name, mode, encoding="utf-8")
+
+    archive = open_or(args.archive, "r", sys.stdin)
+    output = open_or(args.output, "w", sys.stdout)
+    previous = None if args.previous is None else open(args.previous, "r", encoding="utf-8")
+    report = DiffReport()
+    try:
+        old_lines = None if previous is None else (line for line in previous if line.strip())
+        for line in redecode(archive, args.transmitter, args.workers, args.chunk_size):
+            output.write(line + "\n")
+            if old_lines is not None:
+                old = next(old_lines, None)
+                report.compare(None if old is None else json.loads(old), json.loads(line))
+        if old_lines is not None:
+            for old in old_lines:
+                report.compare(json.loads(old), None)
+    finally:
+        for f in (archive, output, previous):
+            if f not in (None, sys.stdin, sys.stdout):
+                f.close()
+    if previous is not None:
+        out = open_or(args.report, "w", sys.stderr if args.output == "-" else sys.stdout)
+        try:
+            report.write(out)
+        finally:
+            if out not in (sys.stdout, sys.stderr):
+                out.close()
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# Keep what has been seen and parsed on disk, so a restart picks up where things left off
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pickle
+import sqlite3
+import threading
+
+
+class StateStore(object):
+    """
+    StateStore keeps state in a SQLite file:
+
+    1. For each feed (by URL), what AtomEventGenerator has seen - the ETag and so on, and a row for each entry
+       id, so that a poll only writes the entries which came or went
+    2. Messages already parsed for a MessageCache, until they expire
+
+    Objects are stored pickled, so only open a file you trust.  One StateStore may be shared among threads.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the file to hold the state, created if need be (or ":memory:" for no file at all)
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+        self.__db.execute("CREATE TABLE IF NOT EXISTS feeds (url TEXT PRIMARY KEY, state BLOB)")
+        self.__db.execute("CREATE TABLE IF NOT EXISTS feed_entries "
+                          "(url TEXT, entry_id TEXT, generation INTEGER, last_seen REAL, PRIMARY KEY (url, entry_id))")
+        self.__db.execute("CREATE TABLE IF NOT EXISTS messages "
+                          "(id INTEGER PRIMARY KEY, event_id TEXT, expires REAL, message BLOB)")
+        self.__db.execute("CREATE INDEX IF NOT EXISTS messages_event ON messages (event_id)")
+
+    def load_feed(self, url):
+        """
+        :return: the state last saved for the feed, or None if there is none
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT state FROM feeds WHERE url=?", (url,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def load_feed_entries(self, url):
+        """
+        :return: [(entry id, generation, last seen), ...] as saved for the feed, in order of generation
+        """
+        with self.__lock:
+            return self.__db.execute("SELECT entry_id, generation, last_seen FROM feed_entries WHERE url=? "
+                                     "ORDER BY generation", (url,)).fetchall()
+
+    def save_feed(self, url, state, entries=(), forgotten=()):
+        """
+        Save the state of a feed, all at once
+
+        :param url: the feed
+        :param state: a picklable object with whatever else the feed needs to resume.  It's rewritten each
+           time, so keep it small.
+        :param entries: (entry id, generation, last seen) for each entry to add or replace
+        :param forgotten: the ids of entries to remove
+        """
+        blob = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        with self.__lock:
+            self.__db.execute("BEGIN")
+            try:
+                self.__db.execute("INSERT OR REPLACE INTO feeds (url, state) VALUES (?, ?)", (url, blob))
+                self.__db.executemany("DELETE FROM feed_entries WHERE url=? AND entry_id=?",
+                                      ((url, entry_id) for entry_id in forgotten))
+                self.__db.executemany("INSERT OR REPLACE INTO feed_entries (url, entry_id, generation, last_seen) "
+                                      "VALUES (?, ?, ?, ?)", ((url,) + tuple(e) for e in entries))
+                self.__db.execute("COMMIT")
+            except Exception:
+                self.__db.execute("ROLLBACK")
+                raise
+
+    def save_message(self, message, expires):
+        """
+        :param message: a message (SAME, VTEC, ...) to keep until its event ends
+        :param expires: when the event ends, now that this message has come, or None if it goes on until
+           further notice.  This applies to the messages already saved for the event, too.
+        """
+        blob = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        with self.__lock:
+            self.__db.execute("BEGIN")
+            try:
+                self.__db.execute("UPDATE messages SET expires=? WHERE event_id=?", (expires, message.event_id))
+                self.__db.execute("INSERT INTO messages (event_id, expires, message) VALUES (?, ?, ?)",
+                                  (message.event_id, expires, blob))
+                self.__db.execute("COMMIT")
+            except Exception:
+                self.__db.execute("ROLLBACK")
+                raise
+
+    def load_messages(self):
+        """
+        :return: the saved messages, in the order they were saved
+        """
+        with self.__lock:
+            rows = self.__db.execute("SELECT message FROM messages ORDER BY id").fetchall()
+        return [pickle.loads(row[0]) for row in rows]
+
+    def forget_messages(self, before):
+        """
+        Remove messages whose events ended before the given time.  Those of events which go on until
+        further notice stay.
+
+        :param before: time in seconds since the epoch
+        :return: how many were removed
+        """
+        with self.__lock:
+            return self.__db.execute("DELETE FROM messages WHERE expires < ?", (before,)).rowcount
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
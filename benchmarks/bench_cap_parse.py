@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# How fast can Atom entries be turned into CAPMessages?
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the top of the repository:
+#   python3 -m benchmarks.bench_cap_parse
+#
+# The entries are those in tests/test_cap.xml, plus the storms captured in tests/kgld.cap.p and
+# tests/kddc.cap.p, written back out as Atom entries like the ones they came from.
+
+import os
+import pickle
+import time
+import warnings
+import xml.etree.ElementTree as etree
+from xml.sax.saxutils import escape
+from RPiNWR.CAP import CAPMessage
+
+_TESTS = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tests")
+_ATOM = "{http://www.w3.org/2005/Atom}"
+
+
+def _iso(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%S-00:00", time.gmtime(t))
+
+
+def _entry_xml(cap):
+    """
+    :param cap: a CAPMessage, as pickled in the test data
+    :return: the Atom entry it came from, near enough
+    """
+    fields = cap._fields()
+    polygon = fields.get('polygon')
+    if polygon is not None:
+        polygon = " ".join("%s,%s" % xy for xy in polygon.exterior.coords)
+    cap_fields = "".join("<cap:%s>%s</cap:%s>" % (k, escape(fields[k]), k) for k in (
+        'event', 'status', 'msgType', 'category', 'urgency', 'severity', 'certainty', 'areaDesc'))
+    return ("<entry><id>%s</id><updated>%s</updated><published>%s</published><author><name>%s</name></author>"
+            "<title>%s</title><link href='%s'/><summary>%s</summary>%s"
+            "<cap:effective>%s</cap:effective><cap:expires>%s</cap:expires><cap:polygon>%s</cap:polygon>"
+            "<cap:geocode><valueName>FIPS6</valueName><value>%s</value><valueName>UGC</valueName><value>%s</value>"
+            "</cap:geocode><cap:parameter><valueName>VTEC</valueName><value>%s</value></cap:parameter></entry>") % (
+        escape(fields['id']), _iso(fields['updated']), _iso(fields['published']), escape(fields['name']),
+        escape(fields['title']), escape(fields['id']), escape(fields['summary']), cap_fields,
+        _iso(fields['effective']), _iso(fields['expires']), polygon or "", " ".join(fields['FIPS6']),
+        fields['UGC'], fields['VTEC'])
+
+
+def load_entries():
+    """
+    :return: a list of Atom entry elements
+    """
+    entries = etree.parse(os.path.join(_TESTS, "test_cap.xml")).getroot().findall(_ATOM + "entry")
+    caps = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # Old shapely pickles
+        for name in ("kgld.cap.p", "kddc.cap.p"):
+            with open(os.path.join(_TESTS, name), "rb") as f:
+                caps.extend(c for t, c in pickle.load(f))
+    feed = "<feed xmlns='http://www.w3.org/2005/Atom' xmlns:cap='urn:oasis:names:tc:emergency:cap:1.1'>%s</feed>" % \
+           "".join(_entry_xml(c) for c in caps)
+    entries.extend(etree.fromstring(feed).findall(_ATOM + "entry"))
+    return entries
+
+
+def bench_cap_parse(entries, seconds=2.0, touch=lambda c: None):
+    """
+    :param touch: a function to call with each CAPMessage, for whatever it should cost beyond construction
+    :return: CAPMessages constructed per second
+    """
+    n = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for e in entries:
+            touch(CAPMessage(e))
+        n += len(entries)
+    return n / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    entries = load_entries()
+    print("%d entries" % len(entries))
+    print("Construction:             %8.0f/sec" % bench_cap_parse(entries))
+    print("Construction + FIPS test: %8.0f/sec" % bench_cap_parse(entries, touch=lambda c: c.applies_to_fips("008125")))
+    print("Construction + VTEC:      %8.0f/sec" % bench_cap_parse(entries, touch=lambda c: c.vtec))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# How fast can the command loop poll the (mock) radio?
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the top of the repository:
+#   python3 -m benchmarks.bench_command_loop
+#
+# The command loop checks interrupts on every pass, and that check is two CTS polls and a write.
+# This times those passes on the MockContext, with the status decoded the old way (a Status object
+# from a list of bytes) and the new way (STATUS_FLAGS indexed from a reusable buffer).
+
+import time
+from RPiNWR.Si4707 import Si4707, Status, STATUS_FLAGS
+from RPiNWR.Si4707.mock import MockContext
+
+
+def _rate(func, seconds):
+    n = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for i in range(0, 100):
+            func()
+        n += 100
+    return n / (time.perf_counter() - start)
+
+
+def bench_status_decoding(seconds=1.0):
+    context = MockContext()
+    buf = bytearray(1)
+
+    def with_status():
+        Status(context.readList(0, 1)).is_clear_to_send()
+
+    def with_table():
+        context.read_into(buf)
+        STATUS_FLAGS[buf[0]].is_clear_to_send()
+
+    return _rate(with_status, seconds), _rate(with_table, seconds)
+
+
+def bench_command_loop(seconds=1.0):
+    """
+    :return: passes per second through the body of the command loop when there's nothing to do
+    """
+    radio = Si4707(MockContext())  # Not entered, so no threads compete for the context
+
+    def loop_pass():
+        status = radio.check_interrupts()
+        status.is_same_interrupt()
+        status.is_audio_signal_quality_interrupt()
+        status.is_received_signal_quality_interrupt()
+        radio._dispatch_any_message()
+
+    return _rate(loop_pass, seconds)
+
+
+if __name__ == '__main__':
+    status_rate, table_rate = bench_status_decoding()
+    print("Status decoding:     %10.0f/sec with Status, %10.0f/sec with STATUS_FLAGS" % (status_rate, table_rate))
+    print("Command loop passes: %10.0f/sec" % bench_command_loop())
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# How fast and how well are noisy SAME headers decoded?
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the top of the repository:
+#   python3 -m benchmarks.bench_same_decoding
+#
+# Valid headers are made up for the transmitters in RPiNWR.nwr_data, then sent three times each through a
+# noisy channel: at the given rate, bytes come through as nulls or with bits flipped, and the confidence of
+# each byte is reported much as the Si4707 does (3 for clean bytes, less for doubtful ones).  Then
+# average_message decodes them, timed, and the results are checked against what was sent.  The corpora are
+# the same each time for a given seed, so an optimization of the decoder can be checked for speed and
+# correctness together.
+#
+# A corpus is a list of dicts like those in tests/dirty_messages.json, so it can be saved for the tests.
+
+import random
+import time
+from RPiNWR.SAME import average_message, SAME_PATTERN, VALID_DURATIONS, _EVENT_CODES
+from RPiNWR.nwr_data import _SAME_TRANSMITTERS, get_counties, get_wfo
+
+NOISE_LEVELS = (0, .02, .04, .08, .16, .24, .32)
+
+# average_message takes the WFO of the transmitter to be a single office
+_TRANSMITTERS = sorted(t for t in _SAME_TRANSMITTERS if isinstance(get_wfo(t), str))
+
+
+def clean_message(rng, when):
+    """
+    :param rng: a random.Random
+    :param when: the time the message is issued
+    :return: (a valid SAME header, the transmitter which would send it)
+    """
+    transmitter = rng.choice(_TRANSMITTERS)
+    counties = list(get_counties(transmitter))
+    counties = rng.sample(counties, rng.randint(1, min(len(counties), 8)))
+    message = "-WXR-%s-%s+%s-%s-%s/NWS-" % (
+        rng.choice(_EVENT_CODES), "-".join(counties), rng.choice(VALID_DURATIONS)[1],
+        time.strftime("%j%H%M", time.gmtime(when)), get_wfo(transmitter))
+    assert SAME_PATTERN.match(message), message
+    return message, transmitter
+
+
+def add_noise(message, rate, rng):
+    """
+    :param message: the header as sent
+    :param rate: the fraction of bytes to damage, 0-1
+    :param rng: a random.Random
+    :return: (the header as received, the confidence of each byte 0-3), with nulls and junk at the end as
+       the Si4707 leaves them
+    """
+    received = []
+    confidence = []
+    for c in message:
+        b = ord(c)
+        if rng.random() >= rate:
+            received.append(b)
+            confidence.append(3 if rng.random() >= rate else 2)
+        elif rng.random() < .5:
+            received.append(0)
+            confidence.append(0)
+        else:
+            for i in range(rng.randint(1, 3)):
+                b ^= 1 << rng.randrange(8)
+            received.append(b)
+            confidence.append(0 if b == 0 else rng.choice((0, 1, 1, 2)))
+    received.extend([0, 0, 0] + [rng.randint(0, 255) for i in range(3)])
+    confidence.extend([0] * 6)
+    return "".join(chr(b) for b in received), confidence
+
+
+def make_corpus(count, rate, seed=0, header_count=3):
+    """
+    :param count: how many messages
+    :param rate: the noise rate (see add_noise)
+    :param seed: for the random numbers, so the corpus is the same each time
+    :param header_count: how many times each header is received
+    :return: a list of dicts with the clean message, its transmitter, and the headers as received with their
+       confidences and times
+    """
+    rng = random.Random("%s %s" % (seed, rate))
+    corpus = []
+    for i in range(count):
+        when = 1462219406 + rng.randrange(86400 * 365)
+        message, transmitter = clean_message(rng, when)
+        corpus.append({
+            "clean": message,
+            "transmitter": transmitter,
+            "headers": [add_noise(message, rate, rng) + (when + 3 + 2 * h,) for h in range(header_count)]
+        })
+    return corpus
+
+
+def bench_decoding(corpus):
+    """
+    Decode the corpus once, with nothing remembered from before.
+    :return: (headers per second, the fraction of messages decoded exactly, wrong bytes per message,
+       mean confidence of the right bytes, mean confidence of the wrong bytes)
+    """
+    average_message.cache_clear()
+    start = time.perf_counter()
+    decoded = [average_message(m["headers"], m["transmitter"]) for m in corpus]
+    elapsed = time.perf_counter() - start
+
+    exact = wrong = 0
+    right_confidence = []
+    wrong_confidence = []
+    for m, (message, confidence) in zip(corpus, decoded):
+        clean = m["clean"]
+        exact += message == clean
+        wrong += abs(len(clean) - len(message))
+        for i in range(min(len(clean), len(message))):
+            if clean[i] == message[i]:
+                right_confidence.append(confidence[i])
+            else:
+                wrong += 1
+                wrong_confidence.append(confidence[i])
+
+    def mean(l):
+        return sum(l) / len(l) if l else 0
+
+    return (sum(len(m["headers"]) for m in corpus) / elapsed, exact / len(corpus), wrong / len(corpus),
+            mean(right_confidence), mean(wrong_confidence))
+
+
+if __name__ == '__main__':
+    print("%6s %12s %8s %12s %12s %12s" % ("noise", "headers", "exact", "wrong bytes", "right conf", "wrong conf"))
+    for rate in NOISE_LEVELS:
+        rate_hps, exact, wrong, right_confidence, wrong_confidence = bench_decoding(make_corpus(500, rate))
+        print("%6.2f %10.0f/s %7.1f%% %12.2f %12.2f %12.2f" % (
+            rate, rate_hps, exact * 100, wrong, right_confidence, wrong_confidence))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# How fast are VTEC, SAME, and HTTP times parsed?
+#
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the top of the repository:
+#   python3 -m benchmarks.bench_time_parsing
+#
+# Each parser is timed three ways: with time.strptime as it used to be, parsing by hand with the cache
+# cleared before every call, and with the cache as it is in use (the same few times over and over, as in the
+# many updates of one event).
+
+import calendar
+import time
+from RPiNWR.VTEC import _parse_vtec_time
+from RPiNWR.SAME import _parse_start_time
+from RPiNWR.atom_events import _parse_http_date
+
+_VTEC_TIMES = ['160525T0039Z', '160525T0115Z', '160524T2300Z', '160525T0500Z', '160526T1200Z', '160523T1920Z']
+_SAME_TIMES = ['1250218', '1242204', '1232003', '1181503', '3031700', '1250153']
+_HTTP_DATES = ['Wed, 25 May 2016 01:24:05 GMT', 'Sun, 22 May 2016 00:41:00 GMT', 'Tue, 24 May 2016 23:59:59 GMT',
+               'Thu, 26 May 2016 12:00:00 GMT']
+
+
+def _rate(func, args, seconds):
+    n = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for a in args:
+            func(*a)
+        n += len(args)
+    return n / (time.perf_counter() - start)
+
+
+def _cold(parser):
+    def parse(*args):
+        parser.cache_clear()
+        return parser(*args)
+
+    return parse
+
+
+def bench(seconds=1.0):
+    """
+    :return: {name: (strptime rate, uncached rate, cached rate)} in parses per second
+    """
+    vtec = [(t,) for t in _VTEC_TIMES]
+    same = [(2016, t) for t in _SAME_TIMES]
+    http = [(d,) for d in _HTTP_DATES]
+    cases = {
+        "VTEC yymmddThhnnZ": (
+            lambda s: calendar.timegm(time.strptime(s.replace("Z", "UTC"), '%y%m%dT%H%M%Z')), _parse_vtec_time, vtec),
+        "SAME JJJHHMM": (
+            lambda y, s: calendar.timegm(time.strptime(str(y) + s + 'UTC', '%Y%j%H%M%Z')), _parse_start_time, same),
+        "HTTP date": (
+            lambda d: calendar.timegm(time.strptime(d, '%a, %d %b %Y %H:%M:%S %Z')), _parse_http_date, http),
+    }
+    return {name: (_rate(old, args, seconds), _rate(_cold(new), args, seconds), _rate(new, args, seconds))
+            for name, (old, new, args) in cases.items()}
+
+
+if __name__ == '__main__':
+    print("%-18s %12s %12s %12s" % ("", "strptime", "by hand", "cached"))
+    for name, rates in bench().items():
+        print("%-18s %10.0f/s %10.0f/s %10.0f/s" % ((name,) + rates))
@@ -26,6 +26,8 @@ import logging
 import json
 from calendar import timegm
 import os
+import subprocess
+import sys
 
 
 class TestSAME(unittest.TestCase):
@@ -424,3 +426,52 @@ class TestSAME(unittest.TestCase):
         self.assertEqual((2, 'L'), SAME._reconcile_character(bitstrue, bitsfalse,
                                                              'ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
 
+    def test_parse_start_time(self):
+        for year, t in ((2016, '1250218'), (2016, '3660000'), (2015, '0010001'), (2011, '1232359')):
+            self.assertEqual(timegm(time.strptime(str(year) + t + 'UTC', '%Y%j%H%M%Z')),
+                             SAME._parse_start_time(year, t), t)
+        for t in ('0000218', '3670218', '1252418', '1250260', '125021', '12502\x008'):
+            self.assertRaises(ValueError, SAME._parse_start_time, 2016, t)
+
+    def test_average_message_memo(self):
+        msg = self.load_dirty_messages()[0]
+        headers = [tuple(h) for h in msg["headers"]]
+        average_message.cache_clear()
+        first = average_message(headers, msg["transmitter"])
+        first[1][0] = -1  # Changing the result doesn't change what's remembered
+        again = average_message([(h, [int(c) for c in cs], t + 1) for h, cs, t in headers], msg["transmitter"])
+        self.assertEqual(SAME._average_message(headers, msg["transmitter"]), again)
+        info = average_message.cache_info()
+        self.assertEqual((1, 1, 1), (info.hits, info.misses, info.currsize))
+
+        # The minute of the first header matters, and so does the transmitter
+        average_message([(h, c, t + 3600) for h, c, t in headers], msg["transmitter"])
+        average_message(headers, None)
+        info = average_message.cache_info()
+        self.assertEqual((1, 3), (info.hits, info.misses))
+
+        for i in range(average_message.cache_info().maxsize + 10):
+            average_message([(h, c, t + 60 * i) for h, c, t in headers[0:1]], msg["transmitter"])
+        info = average_message.cache_info()
+        self.assertEqual(info.maxsize, info.currsize)
+        average_message.cache_clear()
+        info = average_message.cache_info()
+        self.assertEqual((0, 0, 0), (info.hits, info.misses, info.currsize))
+
+    def test_partial_key(self):
+        msg = self.load_dirty_messages()[0]
+        m = SAMEMessage(msg["transmitter"])
+        for header, confidence, t in msg["headers"][:2]:
+            m.add_header(header, confidence)
+            self.assertEqual((SAMEMessage, id(m)), m.get_key())
+            m.get_SAME_message()
+        m.add_header(*msg["headers"][2][:2])
+        self.assertEqual(m.get_SAME_message()[0], m.get_key()[3])
+        self.assertIs(m.get_key(), m.get_key())
+
+    def test_no_shapely(self):
+        # The radio driver imports SAME, and it shouldn't take shapely to run a radio
+        out = subprocess.check_output([sys.executable, "-c",
+                                       "import sys, RPiNWR.SAME; print('shapely' in sys.modules)"],
+                                      cwd=os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+        self.assertEqual(b"False", out.strip())
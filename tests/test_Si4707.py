@@ -18,6 +18,9 @@ __author__ = 'ke4roh'
 
 from RPiNWR.Si4707 import *
 from RPiNWR.Si4707.mock import MockContext
+from RPiNWR.Si4707.buffer import EventBuffer
+from RPiNWR.Si4707.commands import _decompress_patch
+import RPiNWR.SAME as SAME
 import unittest
 import logging
 
@@ -51,6 +54,16 @@ class TestSi4707(unittest.TestCase):
         # Power Down is supposed to happen as part of the __exit__ routine
         self.assertEquals(PowerDown, type(events[-1]))
 
+        # Powering up again uses the patch decoded the first time
+        patched = list(filter(lambda x: type(x) is PatchCommand, events))[0]
+        self.assertTrue(0 <= patched.duration < 1, patched.duration)
+        hits = _decompress_patch.cache_info().hits
+        with MockContext() as context:
+            with Si4707(context) as radio:
+                radio.do_command(
+                    PatchCommand(DEFAULT_CONFIG["power_on"]["patch"], DEFAULT_CONFIG["power_on"]["patch_id"])).get()
+        self.assertEqual(hits + 1, _decompress_patch.cache_info().hits)
+
     def test_exception_in_command(self):
         class ExceptionalCommand(Command):
             def do_command0(self, r):
@@ -266,6 +279,96 @@ class TestSi4707(unittest.TestCase):
             times = len(self.__filter_same_events(events, interrupt))
             self.assertEquals(3, times, "Interrupt %s happened %d times" % (interrupt, times))
 
+    def test_event_buffer_overflow(self):
+        buf = EventBuffer(maxsize=3)
+        message = SAMEMessageReceivedEvent(SAME.SAMEMessage("-WXR-TOR-020103+0030-3031701-KEAX/NWS-"))
+        first_rsq = ReceivedSignalQualityCheck()
+        last_rsq = ReceivedSignalQualityCheck()
+        buf.put_nowait(first_rsq)
+        buf.put_nowait(GetProperty("RX_VOLUME"))
+        buf.put_nowait(RadioPowerEvent(True))
+
+        # A newer status report stands in for the older one
+        self.assertTrue(buf.put_nowait(last_rsq))
+        self.assertEqual(1, buf.coalesced)
+        self.assertEqual(0, buf.dropped)
+
+        # Routine events are shed in favor of more important ones
+        self.assertTrue(buf.put_nowait(message))
+        self.assertEqual(1, buf.dropped)
+        self.assertFalse(buf.put_nowait(GetProperty("RX_VOLUME")))
+        self.assertEqual(2, buf.dropped)
+
+        # ...but a received message is never dropped
+        self.assertTrue(buf.put_nowait(SAMEMessageReceivedEvent(message.message)))
+        self.assertTrue(buf.put_nowait(SAMEMessageReceivedEvent(message.message)))
+        self.assertEqual(4, buf.dropped)
+        self.assertTrue(buf.put_nowait(SAMEMessageReceivedEvent(message.message)))
+        self.assertEqual(4, buf.qsize())
+        self.assertEqual(4, buf.dropped)
+
+        events = []
+        while not buf.empty():
+            events.append(buf.get(block=False))
+            buf.task_done()
+        self.assertEqual([SAMEMessageReceivedEvent] * 4, [type(x) for x in events])
+        self.assertRaises(queue.Empty, buf.get, True, 0.01)
+
+    def test_status_flags(self):
+        for b in range(0, 256):
+            flags = STATUS_FLAGS[b]
+            if b & 0xC0 == 0xC0:
+                self.assertRaises(StatusError, Status, [b])
+                continue
+            status = Status([b])
+            for check in ["is_clear_to_send", "is_error", "is_received_signal_quality_interrupt", "is_same_interrupt",
+                          "is_audio_signal_quality_interrupt", "is_seek_tune_complete", "is_interrupt"]:
+                self.assertEqual(bool(getattr(status, check)()), bool(getattr(flags, check)()), "%s %d" % (check, b))
+
+    def test_status_error(self):
+        with MockContext() as context:
+            radio = Si4707(context)
+            context.registers[0][0] = 0xC0
+            self.assertRaises(StatusError, radio.wait_for_clear_to_send)
+            context.registers[0][0] = 0x84
+            self.assertTrue(radio.wait_for_clear_to_send().is_same_interrupt())
+            self.assertIs(STATUS_FLAGS[0x84], radio.status)
+
+    def test_context_io(self):
+        class ListContext(Context):
+            # Written before read_into
+            def read_bytes(self, num_bytes):
+                return [128, 1, 2, 3][0:num_bytes]
+
+        class BufferContext(Context):
+            def read_into(self, buf):
+                for i in range(0, len(buf)):
+                    buf[i] = 128 | i
+                return len(buf)
+
+        buf = bytearray(3)
+        self.assertEqual(3, ListContext().read_into(buf))
+        self.assertEqual(bytearray([128, 1, 2]), buf)
+        self.assertEqual(bytes([128, 129, 130]), BufferContext().read_bytes(3))
+
+    def test_slow_listener(self):
+        events = []
+
+        def slow_listener(event):
+            time.sleep(.05)
+            events.append(event)
+
+        with MockContext() as context:
+            with Si4707(context, EventBuffer(maxsize=2)) as radio:
+                radio.register_event_listener(slow_listener)
+                radio.power_on({"frequency": 162.4, "properties": {}})
+                for i in range(0, 10):
+                    radio.do_command(ReceivedSignalQualityCheck())
+                radio.get_volume()
+
+        self.assertTrue(radio.event_buffer.coalesced + radio.event_buffer.dropped > 0, str(radio.event_buffer))
+        self.assertEqual(0, len(list(filter(lambda x: type(x) is CommandExceptionEvent, events))))
+
 
 if __name__ == '__main__':
     unittest.main()
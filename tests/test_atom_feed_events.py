@@ -30,6 +30,13 @@ import calendar
 import RPiNWR.atom_events as ae
 from RPiNWR.CAP import CAPMessage
 import pickle
+import io
+import re
+import tracemalloc
+import socket
+import urllib3
+import tempfile
+from RPiNWR.state import StateStore
 
 
 class OneFileAtATimeHandler(http.server.BaseHTTPRequestHandler):
@@ -125,7 +132,7 @@ class TestAtomCAPFeed(unittest.TestCase):
 
         aeg = ae.AtomEventGenerator("http://localhost:1989/", atom_event_handler, polling_interval_sec=.01)
         timeout = time.time() + 600  # 600 to get them all
-        while time.time() < timeout and 410 != aeg.status.msg:
+        while time.time() < timeout and not aeg.status.msg.startswith("HTTP 410"):
             # TODO get this to die gracefully rather thaAn wait for timeout when killed
             time.sleep(.1)
         aeg.stop = True
@@ -137,3 +144,350 @@ class TestAtomCAPFeed(unittest.TestCase):
 
         # TODO write a simple test for atom events (not a loop over 2 hours of storms)
         # TODO test for web error handling
+
+
+class ConditionalHandler(http.server.BaseHTTPRequestHandler):
+    """
+    This handler serves test_cap.xml over and over, with validators, and answers conditional requests
+    with 304 Not Modified if conditional is set.
+    """
+    file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_cap.xml")
+    etag = '"test_cap-1"'
+    last_modified = 'Sun, 22 May 2016 00:41:00 GMT'
+    conditional = True
+    requests = []
+
+    def do_GET(self):
+        ConditionalHandler.requests.append(dict(self.headers))
+        if self.path.startswith("/error"):
+            self.send_error(503)
+            return
+        if ConditionalHandler.conditional and (self.headers.get('If-None-Match') == self.etag or
+                                               self.headers.get('If-Modified-Since') == self.last_modified):
+            self.send_response(304)
+            self.send_header("Content-Length", 0)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-type", "application/atom+xml")
+        self.send_header("Content-Length", os.path.getsize(self.file))
+        self.send_header("ETag", self.etag)
+        self.send_header("Last-Modified", self.last_modified)
+        self.end_headers()
+        with open(self.file, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestConditionalGet(unittest.TestCase):
+    def setUp(self):
+        ConditionalHandler.requests = []
+        ConditionalHandler.conditional = True
+        self.httpd = http.server.HTTPServer(("localhost", 0), ConditionalHandler)
+        self.url = "http://localhost:%d/" % self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def poll(self, polls):
+        events = []
+        aeg = ae.AtomEventGenerator(self.url, events.append, polling_interval_sec=.01)
+        timeout = time.time() + 10
+        while len(ConditionalHandler.requests) < polls and time.time() < timeout:
+            time.sleep(.01)
+        aeg.stop = True
+        self.assertTrue(time.time() < timeout)
+        return aeg, events
+
+    def test_not_modified(self):
+        aeg, events = self.poll(3)
+        self.assertEqual('"test_cap-1"', aeg.etag)
+        self.assertNotIn('If-None-Match', ConditionalHandler.requests[0])
+        self.assertEqual('"test_cap-1"', ConditionalHandler.requests[1]['If-None-Match'])
+        self.assertEqual('Sun, 22 May 2016 00:41:00 GMT', ConditionalHandler.requests[1]['If-Modified-Since'])
+        self.assertEqual("OK", aeg.status.msg)
+        self.assertEqual(4, len([x for x in events if type(x) is ae.NewAtomEntry]))
+
+    def test_feed_not_updated(self):
+        ConditionalHandler.conditional = False
+        aeg, events = self.poll(3)
+        self.assertEqual(4, len([x for x in events if type(x) is ae.NewAtomEntry]))
+        self.assertEqual(0, len([x for x in events if type(x) is ae.DeletedAtomEntry]))
+
+
+class TestFeedManager(unittest.TestCase):
+    def setUp(self):
+        ConditionalHandler.requests = []
+        ConditionalHandler.conditional = True
+        self.httpd = http.server.HTTPServer(("localhost", 0), ConditionalHandler)
+        self.url = "http://localhost:%d/" % self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_many_feeds(self):
+        threads = threading.active_count()
+        events = [[] for i in range(12)]
+        with ae.AtomFeedManager(workers=3) as manager:
+            feeds = [ae.AtomEventGenerator(self.url + "feed%d" % i, events[i].append, polling_interval_sec=.05,
+                                           manager=manager) for i in range(12)]
+            bad = ae.AtomEventGenerator(self.url + "error", lambda x: None, polling_interval_sec=.01, manager=manager,
+                                        retries=0)
+            timeout = time.time() + 10
+            while len(ConditionalHandler.requests) < 50 and time.time() < timeout:
+                time.sleep(.01)
+            self.assertLessEqual(threading.active_count() - threads, 4)
+        self.assertTrue(time.time() < timeout)
+        for feed_events in events:
+            self.assertEqual("OK", feed_events[0].msg)
+            self.assertEqual(["NewAtomEntry"] * 4, [type(x).__name__ for x in feed_events[1:]])
+            published = [x.message.find("{http://www.w3.org/2005/Atom}published").text for x in feed_events[1:]]
+            self.assertEqual(sorted(published), published)
+        self.assertTrue(all(x.failures == 0 for x in feeds))
+        # Backing off, it can't have been polled much
+        self.assertGreater(bad.failures, 0)
+        self.assertLess(bad.failures, 10)
+        self.assertGreaterEqual(bad.next_delay(), .01)
+
+
+class FlakyHandler(ConditionalHandler):
+    """
+    This handler hangs up without answering, or answers too slowly, or serves the feed, depending on mode.
+    """
+    mode = "drop"
+
+    def do_GET(self):
+        ConditionalHandler.requests.append(FlakyHandler.mode)
+        if FlakyHandler.mode == "drop":
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+        elif FlakyHandler.mode == "slow":
+            time.sleep(.5)
+        else:
+            super().do_GET()
+
+
+class TestNetTrouble(unittest.TestCase):
+    def setUp(self):
+        ConditionalHandler.requests = []
+        ConditionalHandler.conditional = True
+        self.httpd = http.server.ThreadingHTTPServer(("localhost", 0), FlakyHandler)
+        self.httpd.daemon_threads = True
+        self.url = "http://localhost:%d/" % self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def wait_for(self, condition):
+        timeout = time.time() + 10
+        while not condition() and time.time() < timeout:
+            time.sleep(.01)
+        self.assertTrue(condition())
+
+    def test_breaker(self):
+        FlakyHandler.mode = "drop"
+        events = []
+        aeg = ae.AtomEventGenerator(self.url, events.append, polling_interval_sec=.01, max_backoff_sec=.2,
+                                    retries=urllib3.Retry(1, backoff_factor=.01), breaker_threshold=3)
+        try:
+            self.wait_for(lambda: aeg.circuit_open)
+            # Every try (with retries) failed, and the thread kept going
+            self.assertEqual(3, aeg.failures)
+            self.assertEqual(6, len(ConditionalHandler.requests))
+            self.assertFalse(events[0].normal)
+            self.assertTrue(events[-1].msg.startswith("Circuit open after 3 failures"))
+            self.assertGreaterEqual(aeg.next_delay(), .1)
+
+            # Probes while the circuit is open are no news
+            count = len(events)
+            self.wait_for(lambda: aeg.failures > 4)
+            self.assertEqual(count, len(events))
+
+            FlakyHandler.mode = "ok"
+            self.wait_for(lambda: aeg.status.normal)
+            self.assertFalse(aeg.circuit_open)
+            self.assertEqual(0, aeg.failures)
+            self.assertEqual(.01, aeg.next_delay())
+            self.wait_for(lambda: 5 == len(events) - count)
+            self.assertEqual("OK", events[count].msg)
+        finally:
+            aeg.stop = True
+
+    def test_timeout(self):
+        FlakyHandler.mode = "slow"
+        events = []
+        aeg = ae.AtomEventGenerator(self.url, events.append, polling_interval_sec=.01, read_timeout_sec=.1,
+                                    retries=0)
+        try:
+            self.wait_for(lambda: len(events))
+            self.assertFalse(events[0].normal)
+            self.assertIn("timed out", events[0].msg)
+            self.wait_for(lambda: aeg.failures > 1)
+        finally:
+            aeg.stop = True
+
+
+class ServeBodyHandler(ConditionalHandler):
+    """
+    This handler serves whatever is in body.
+    """
+    body = b""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-type", "application/atom+xml")
+        self.send_header("Content-Length", len(ServeBodyHandler.body))
+        self.end_headers()
+        self.wfile.write(ServeBodyHandler.body)
+
+
+class ManualPolling(object):
+    """
+    A stand-in for AtomFeedManager which leaves the polling to the test
+    """
+
+    def __init__(self):
+        self.http = urllib3.PoolManager()
+
+    def add(self, feed):
+        pass
+
+
+class TestEntryLifetime(unittest.TestCase):
+    def setUp(self):
+        self.httpd = http.server.HTTPServer(("localhost", 0), ServeBodyHandler)
+        self.url = "http://localhost:%d/" % self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_cap.xml"), "rb") as f:
+            self.xml = f.read()
+        self.entries = re.findall(b"<entry>.*?</entry>", self.xml, re.DOTALL)
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve(self, entries, minutes):
+        """
+        :param entries: indices of the entries to include in the feed
+        :param minutes: how many minutes past 19:00 the feed was updated
+        """
+        start = self.xml.index(b"<entry>")
+        end = self.xml.rindex(b"</entry>") + len(b"</entry>")
+        head = self.xml[:start].replace(b"<updated>2016-05-21T19:41:00-05:00</updated>",
+                                        b"<updated>2016-05-21T%02d:%02d:00-05:00</updated>" % divmod(
+                                            19 * 60 + minutes, 60))
+        ServeBodyHandler.body = head + b"".join(self.entries[i] for i in entries) + self.xml[end:]
+
+    def test_persistence(self):
+        events = []
+        aeg = ae.AtomEventGenerator(self.url, events.append, persistence_sec=600, manager=ManualPolling())
+
+        def poll(entries, minutes):
+            del events[:]
+            self.serve(entries, minutes)
+            self.assertTrue(aeg.poll())
+            return [type(x).__name__ for x in events if type(x) is not ae.NetStatus]
+
+        self.assertEqual(["NewAtomEntry"] * 4, poll([0, 1, 2, 3], 0))
+        self.assertEqual([], poll([1, 2, 3], 1))
+        self.assertEqual([], poll([0, 1, 2, 3], 2))  # came back before it expired
+        self.assertEqual([], poll([1, 2, 3], 3))
+        self.assertEqual([], poll([1, 2, 3], 11))  # last seen at 2, so gone at 12
+        self.assertEqual(["DeletedAtomEntry"], poll([1, 2, 3], 12))
+        self.assertEqual(3, len(aeg.id_cache))
+        self.assertEqual(["NewAtomEntry", "DeletedAtomEntry", "DeletedAtomEntry"], poll([0, 3], 30))
+        self.assertEqual(2, len(aeg.id_cache))
+        self.assertEqual(7, aeg.generation)
+
+    def test_warm_restart(self):
+        events = []
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "state.db")
+            with StateStore(path) as store:
+                aeg = ae.AtomEventGenerator(self.url, events.append, persistence_sec=600, manager=ManualPolling(),
+                                            state_store=store)
+                for entries, minutes in (([0, 1, 2, 3], 0), ([1, 2, 3], 1)):
+                    self.serve(entries, minutes)
+                    aeg.poll()
+                # A row for each entry, with the generation in which it left the feed
+                self.assertEqual(sorted(aeg.id_cache.items(), key=str),
+                                 sorted(((i, g) for i, g, t in store.load_feed_entries(self.url)), key=str))
+                self.assertEqual([None, None, None, 2], [g for i, g, t in store.load_feed_entries(self.url)])
+            self.assertEqual(4, len([x for x in events if type(x) is ae.NewAtomEntry]))
+
+            del events[:]
+            with StateStore(path) as store:
+                aeg = ae.AtomEventGenerator(self.url, events.append, persistence_sec=600, manager=ManualPolling(),
+                                            state_store=store)
+                self.assertEqual(2, aeg.generation)
+                self.serve([1, 2, 3], 2)
+                aeg.poll()
+                self.assertEqual(0, len([x for x in events if type(x) is not ae.NetStatus]))
+                self.serve([1, 2, 3], 10)
+                aeg.poll()
+                self.assertEqual(["DeletedAtomEntry"], [type(x).__name__ for x in events if type(x) is not ae.NetStatus])
+                self.assertEqual(3, len(store.load_feed_entries(self.url)))
+
+
+class TestReadFeed(unittest.TestCase):
+    @staticmethod
+    def big_feed(n):
+        """
+        :return: test_cap.xml with its entries repeated (under new ids) to make n of them
+        """
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_cap.xml"), "rb") as f:
+            xml = f.read()
+        start = xml.index(b"<entry>")
+        end = xml.rindex(b"</entry>") + len(b"</entry>")
+        entries = re.findall(b"<entry>.*?</entry>", xml[start:end], re.DOTALL)
+        body = b"".join(re.sub(b"(<id>\\s*)", b"\\g<1>%d-" % i, entries[i % len(entries)]) for i in range(n))
+        return xml[:start] + body + xml[end:]
+
+    def test_same_as_dom(self):
+        xml = self.big_feed(12)
+        known = set()
+        for i in range(2):
+            updated, new, ids = ae.read_feed(io.BytesIO(xml), known)
+            dom_updated, dom_new, dom_ids = ae.read_feed_dom(io.BytesIO(xml), known)
+            self.assertEqual(dom_updated, updated)
+            self.assertEqual(dom_ids, ids)
+            self.assertEqual([etree_id(x) for x in dom_new], [etree_id(x) for x in new])
+            self.assertEqual(12 if i == 0 else 6, len(new))
+            known = set(list(sorted(ids))[0:6])
+        self.assertIsNone(ae.read_feed(io.BytesIO(xml), (), updated))
+        self.assertIsNone(ae.read_feed_dom(io.BytesIO(xml), (), updated))
+
+    def test_flat_memory(self):
+        def peak(reader, xml):
+            known = reader(io.BytesIO(xml))[2]
+            tracemalloc.start()
+            try:
+                reader(io.BytesIO(xml), known)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        xml = self.big_feed(2000)
+        streaming = peak(ae.read_feed, xml)
+        self.assertLess(streaming * 4, peak(ae.read_feed_dom, xml))
+
+
+def etree_id(entry):
+    return entry.find("{http://www.w3.org/2005/Atom}id").text
+
+
+class TestNetStatus(unittest.TestCase):
+    def test_http_date(self):
+        self.assertEqual(1464139445, ae.NetStatus("OK", True, 'Wed, 25 May 2016 01:24:05 GMT').time)
+        self.assertEqual(1464139445, ae.NetStatus("OK", True, ' Wed, 25 May 2016 01:24:05 UTC ').time)
+        self.assertEqual(12.5, ae.NetStatus("OK", True, 12.5).time)
+        self.assertRaises(ValueError, ae.NetStatus, "OK", True, 'Wed, 25 Mai 2016 01:24:05 GMT')
+        self.assertRaises(ValueError, ae.NetStatus, "OK", True, 'Wed, 32 May 2016 01:24:05 GMT')
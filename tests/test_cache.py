@@ -18,9 +18,17 @@ __author__ = 'ke4roh'
 import unittest
 from RPiNWR.SAME import *
 from RPiNWR.cache import *
+from RPiNWR.alerts import *
 from RPiNWR.VTEC import *
 import pickle
 import os
+import tempfile
+import calendar
+import copy
+import sys
+import threading
+import time
+from RPiNWR.state import StateStore
 
 class TestCache(unittest.TestCase):
     def test_buffer_for_radio_against_storm_system(self):
@@ -465,7 +473,7 @@ class TestCache(unittest.TestCase):
 146 03:13  KGLD.TO.A.0206 --- KGLD.TO.W.0031,KGLD.TO.A.0204
 146 03:16  KGLD.TO.A.0206 --- KGLD.TO.W.0032,KGLD.TO.A.0204
 146 03:39  KGLD.TO.A.0206 --- KGLD.TO.W.0032,KGLD.TO.A.0204
-146 03:50  KGLD.TO.A.0206 --- KGLD.TO.W.0032,KGLD.TO.A.0204
+146 03:50  KGLD.TO.A.0206 --- KGLD.TO.A.0204
 146 04:05  KGLD.TO.A.0206 --- KGLD.TO.A.0204
 146 04:33  KGLD.TO.A.0206 --- KGLD.SV.W.0094,KGLD.TO.A.0204
 146 04:55  KGLD.TO.A.0206 --- KGLD.SV.W.0094,KGLD.TO.A.0204
@@ -527,3 +535,307 @@ class TestCache(unittest.TestCase):
         buf.add_message(valerts[0])
         self.assertTrue(buf.is_effective((40.321909, -102.718192), "008125", True, valerts[0].published))
         self.assertFalse(buf.is_effective((40.321909, -102.718192), "008125", False, valerts[0].published))
+
+    def test_warm_restart(self):
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            alerts = pickle.load(f)
+        t = alerts[20][0]
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "state.db")
+            with StateStore(path) as store:
+                buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort, state_store=store)
+                for a, c in alerts[0:21]:
+                    for v in c.vtec:
+                        buf.add_message(v)
+                        buf.add_message(v)  # Duplicates don't get stored
+                stored = sum(len(g.messages) for g in buf._MessageCache__messages.values())
+                expected = [[x.get_event_id() for x in buf.get_active_messages(when=t, here=h)] for h in (True, False)]
+
+            with StateStore(path) as store:
+                self.assertEqual(stored, len(store.load_messages()))
+                buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort, state_store=store)
+                self.assertEqual(expected, [[x.get_event_id() for x in buf.get_active_messages(when=t, here=h)]
+                                            for h in (True, False)])
+                buf.clear_inactive(t + 86400)
+                self.assertEqual([], store.load_messages())
+
+    def test_clear_inactive(self):
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            valerts = [v for a, c in pickle.load(f) for v in c.vtec]
+        ends = {}
+        for v in valerts:
+            ends[v.event_id] = max(ends.get(v.event_id, 0), v.get_end_time_sec())
+        times = sorted(set(ends.values()))
+
+        buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort, sweep_batch=2)
+        for v in valerts:
+            buf.add_message(v)
+        self.assertEqual(0, buf.clear_inactive(times[0] - 1))
+        self.assertEqual(len([e for e in ends.values() if e <= times[1]]), buf.clear_inactive(times[1]))
+        self.assertEqual(len(ends) - buf.evicted, buf.clear_inactive(times[-1]))
+        self.assertEqual(len(ends), buf.evicted)
+        self.assertEqual([], buf.get_active_messages(when=times[-1] - 1, here=False))
+
+        # It still takes messages afterward
+        buf.add_message(valerts[-1])
+        self.assertEqual(1, len(buf.get_active_messages(when=valerts[-1].get_end_time_sec() - 1)) +
+                         len(buf.get_active_messages(when=valerts[-1].get_end_time_sec() - 1, here=False)))
+
+        # And cleans up after itself, given the chance
+        buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort, sweep_interval_sec=0.05)
+        try:
+            for v in valerts:
+                buf.add_message(v)
+            timeout = time.time() + 5
+            while buf.evicted < len(ends) and time.time() < timeout:
+                time.sleep(0.01)
+            self.assertEqual(len(ends), buf.evicted)
+        finally:
+            buf.close()
+
+    def test_until_further_notice(self):
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            v = [v for a, c in pickle.load(f) for v in c.vtec][0]
+        end = v.get_end_time_sec()
+
+        def extended(end_time):
+            x = copy.copy(v)
+            x.action, x.end_time, x._key = "EXT", end_time, None
+            return x
+
+        with StateStore(":memory:") as store:
+            buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort, state_store=store)
+            buf.add_message(v)
+            buf.add_message(extended(None))
+            self.assertEqual(0, buf.clear_inactive(end + 1))
+            self.assertEqual(2, len(store.load_messages()))
+            buf.add_message(extended(end + 3600))
+            self.assertEqual(0, buf.clear_inactive(end + 1))
+            self.assertEqual(3, len(store.load_messages()))
+            self.assertEqual(1, buf.clear_inactive(end + 3601))
+            self.assertEqual([], store.load_messages())
+
+        # And the other way around
+        buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort)
+        buf.add_message(extended(None))
+        self.assertEqual(0, buf.clear_inactive(end + 1))
+        buf.add_message(v)
+        self.assertEqual(1, buf.clear_inactive(end + 1))
+
+    def test_concurrent_readers(self):
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            valerts = [v for a, c in pickle.load(f) for v in c.vtec]
+        t = valerts[len(valerts) // 2].published
+        same = [SAMEMessage("WXL58", "-WXR-%s-0%s+0030-12500%02d-KGLD/NWS-" % (e, f, m))
+                for m in range(0, 40) for e, f in (("TOR", "08125"), ("SVR", "20181"))]
+        same_t = same[-1].get_start_time_sec() + 60
+
+        def check(cache, messages, clear, when):
+            errors = []
+            done = threading.Event()
+
+            def read():
+                try:
+                    while not done.is_set():
+                        cache.get_active_messages(when=when)
+                        cache.get_active_messages(when=when, here=False)
+                except Exception as e:
+                    errors.append(e)
+
+            readers = [threading.Thread(target=read) for i in range(4)]
+            interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)  # Switch threads often, to make trouble
+            for r in readers:
+                r.start()
+            try:
+                for i, m in enumerate(messages):
+                    cache.add_message(m)
+                    if i % 20 == 19:
+                        clear()
+            finally:
+                done.set()
+                for r in readers:
+                    r.join()
+                sys.setswitchinterval(interval)
+            self.assertEqual([], errors)
+
+        buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort)
+        check(buf, valerts, lambda: buf.clear_inactive(t - 3600), t)
+        expected = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort)
+        for v in valerts:
+            expected.add_message(v)
+        for h in (True, False):
+            self.assertEqual([x.get_event_id() for x in expected.get_active_messages(when=t, here=h)],
+                             [x.get_event_id() for x in buf.get_active_messages(when=t, here=h)])
+
+        cache = SAMECache("008125")
+        check(cache, same, lambda: None, same_t)
+        for h, fips in ((True, "008125"), (False, "020181")):
+            active = [m for m in same if m.applies_to_fips(fips) and m.is_effective(same_t)]
+            self.assertTrue(active)
+            self.assertEqual(len(active), len(cache.get_active_messages(when=same_t, here=h)))
+
+    def test_subscribe(self):
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            valerts = sorted((v for a, c in pickle.load(f) for v in c.vtec), key=lambda v: v.published)
+        now = [valerts[0].published]
+
+        def replay(events):
+            l = []
+            for e in events:
+                if isinstance(e, AlertAdded):
+                    l.insert(e.rank, e.message)
+                elif isinstance(e, AlertRemoved):
+                    self.assertIs(e.message, l.pop(e.rank))
+                else:
+                    self.assertIs(e.message, l.pop(e.old_rank))
+                    l.insert(e.rank, e.message)
+            return l
+
+        buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort)
+        events = {True: [], False: []}
+        views = {h: buf.subscribe(events[h].append, here=h) for h in (True, False)}
+        try:
+            for view in views.values():
+                view.clock = lambda: now[0]
+            times = sorted(set(t for v in valerts for t in (v.published, v.get_end_time_sec())))
+            vix = 0
+            for t in times + [times[-1] + 1]:
+                now[0] = t
+                for view in views.values():
+                    view.advance()
+                while vix < len(valerts) and valerts[vix].published <= t:
+                    buf.add_message(valerts[vix])
+                    vix += 1
+                for h in (True, False):
+                    expected = buf.get_active_messages(when=t, here=h)
+                    self.assertEqual(expected, list(views[h].messages))
+                    self.assertEqual(expected, replay(events[h]))
+            self.assertEqual((), views[True].messages)
+            self.assertTrue(any(isinstance(e, AlertRemoved) for e in events[True]))
+        finally:
+            buf.close()
+
+        # SAME messages come and go, too
+        cache = SAMECache("037183")
+        events = []
+        view = cache.subscribe(events.append)
+        try:
+            start = time.time()
+            for m in ("-WXR-SVR-037183+0015-%s-KRAH/NWS-", "-WXR-TOR-037183+0030-%s-KRAH/NWS-"):
+                cache.add_message(SAMEMessage("WXL58", m % time.strftime("%j%H%M", time.gmtime(start))))
+            self.assertEqual(["TOR", "SVR"], [m.get_event_type() for m in view.messages])
+            self.assertEqual([AlertAdded, AlertAdded], [type(e) for e in events])
+            view.clock = lambda: start + 20 * 60
+            view.advance()
+            self.assertEqual(["TOR"], [m.get_event_type() for m in view.messages])
+            self.assertEqual((AlertRemoved, 1), (type(events[-1]), events[-1].rank))
+        finally:
+            cache.close()
+
+        # A message changing places
+        events = []
+        view = AlertView(lambda m, when: True, lambda a, b: a[0] - b[0], timer=False)
+        view.add_listener(events.append)
+        a, b, c = [1], [2], [3]
+        for m in (c, a, b):
+            view.update(m)
+        self.assertEqual([a, b, c], list(view.messages))
+        a[0] = 4
+        view.update(a)
+        self.assertEqual([b, c, a], list(view.messages))
+        self.assertEqual((AlertPriorityChanged, 0, 2), (type(events[-1]), events[-1].old_rank, events[-1].rank))
+        view.update(a)
+        self.assertEqual(4, len(events))
+
+    def test_filters(self):
+        self.assertEqual(["W", "W", "A", "W", "E", "A", "Y"],
+                         [get_significance(t) for t in ("TOR", "SVR", "TOA", "FFW", "EVI", "TO.A", "WI.Y")])
+        warnings = MessageFilter(significance="W")
+        tornado = MessageFilter(event_types=["TO.W", "TO.A", "TOR", "TOA"])
+        weather = MessageFilter(event_pattern="[A-Z][A-Z].[WA]|T|S")
+
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            valerts = sorted((v for a, c in pickle.load(f) for v in c.vtec), key=lambda v: v.published)
+        buf = MessageCache((40.321909, -102.718192), "008125", default_VTEC_sort)
+        buf.add_filter("warnings", warnings)
+        half = len(valerts) // 2
+        for v in valerts[:half]:
+            buf.add_message(v)
+        buf.add_filter("tornado", tornado)
+        buf.add_filter("weather", weather)
+        for v in valerts[half:]:
+            buf.add_message(v)
+        buf.clear_inactive(valerts[half].published)
+
+        sames = [SAMEMessage("WXL58", m) for m in (
+            "-WXR-SVR-037183+0030-1232003-KRAH/NWS-", "-WXR-TOA-037183-037151+0400-1232003-KRAH/NWS-",
+            "-WXR-TOR-037183+0030-1232004-KRAH/NWS-", "-WXR-FFA-037151+0600-1232005-KRAH/NWS-",
+            "-WXR-SVS-037183+0030-1232010-KRAH/NWS-", "-WXR-RWT-037183+0015-1232015-KRAH/NWS-")]
+        same_t = sames[-1].get_start_time_sec() + 60
+        same = SAMECache("037183")
+        same.add_filter("warnings", warnings)
+        for m in sames:
+            same.add_message(m)
+        same.add_filter("tornado", tornado)
+        same.add_filter("weather", weather)
+
+        for cache, times in ((buf, [v.published for v in valerts[half:]]), (same, [same_t])):
+            some = 0
+            for t in times:
+                for h in (True, False):
+                    everything = cache.get_active_messages(when=t, here=h)
+                    for name, message_filter in (("warnings", warnings), ("tornado", tornado),
+                                                 ("weather", weather)):
+                        expected = [m for m in everything if message_filter.matches(m)]
+                        self.assertEqual(expected, cache.get_active_messages(when=t, here=h, filter_name=name))
+                        some += len(expected)
+            self.assertTrue(some)
+        self.assertEqual(["TOR", "TOA"],
+                         [m.get_event_type() for m in same.get_active_messages(when=same_t, filter_name="tornado")])
+        self.assertEqual({"TOR", "TOA", "SVR", "SVS"}, set(m.get_event_type() for m in same.get_active_messages(
+            when=same_t, filter_name="weather")))
+
+    def test_duplicates(self):
+        msg = "-WXR-SVR-037183+0045-1232003-KRAH/NWS-"
+        group = EventMessageGroup()
+        m1 = SAMEMessage("WXL58", msg)
+        self.assertTrue(group.add_message(m1))
+        self.assertFalse(group.add_message(m1))
+        self.assertFalse(group.add_message(SAMEMessage("WXL58", msg)))
+        self.assertEqual(1, len(group.messages))
+
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            alerts = pickle.load(f)
+        valerts = [v for a, c in alerts for v in c.vtec if v.event_id == "KGLD.TO.A.0204"]
+        group = EventMessageGroup()
+        group.add_messages(valerts)
+        group.add_messages(pickle.loads(pickle.dumps(valerts)))
+        self.assertEqual(len(set(valerts)), len(group.messages))
+
+    def test_actions(self):
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            alerts = pickle.load(f)
+
+        def group_of(event_id, reverse=False):
+            group = EventMessageGroup()
+            group.add_messages(sorted((v for a, c in alerts for v in c.vtec if v.event_id == event_id),
+                                      key=lambda v: v.published, reverse=reverse))
+            return group
+
+        def at(group, fips, jjjhhmm):
+            when = calendar.timegm(time.strptime("2016" + jjjhhmm, "%Y%j%H%M"))
+            return group.is_effective(None, fips, True, when)
+
+        for reverse in (False, True):  # The order in which they arrive shouldn't matter
+            tornado = group_of("KGLD.TO.W.0032", reverse)  # NEW 03:14, CON 03:37, CAN 03:48, end 04:00
+            self.assertFalse(at(tornado, "031057", "1460310"))
+            self.assertTrue(at(tornado, "031057", "1460320"))
+            self.assertTrue(at(tornado, "031057", "1460347"))
+            self.assertFalse(at(tornado, "031057", "1460349"))
+            self.assertFalse(at(tornado, "031057", "1460410"))
+
+        storm = group_of("KGLD.SV.W.0094")  # NEW 04:32, CON 04:53, EXP 05:07 ahead of the end at 05:15
+        self.assertTrue(at(storm, "008125", "1460510"))
+        self.assertFalse(at(storm, "008125", "1460516"))
+        self.assertFalse(at(storm, "031057", "1460510"))
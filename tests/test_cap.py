@@ -22,7 +22,9 @@ import os
 from glob import glob
 import xml.etree.ElementTree as etree
 import RPiNWR.CAP as CAP
+from RPiNWR.SAME import SAMEMessage
 import time
+import pickle
 from shapely.geometry import Point
 
 
@@ -62,3 +64,53 @@ class TestCAP(unittest.TestCase):
         self.assertEqual(1464049200.0, cm.get_end_time_sec())
         self.assertTrue(cm.polygon.contains(Point(29.6011519, -98.0439125)))
         self.assertFalse(cm.polygon.contains(Point(29.582935, -97.969713)))
+
+    def test_pickle(self):
+        cm = CAP.CAPMessage(TestCAP._get_test_messages()[0])
+        self.assertFalse(hasattr(cm, '__dict__'))
+        self.assertEqual('Tornado Warning', cm.event)
+        self.assertEqual('w-nws.webmaster@noaa.gov', cm.name)
+        self.assertEqual(['020109', '020199'], cm.FIPS6)
+        self.assertEqual(1463877540.0, cm.published)
+        cm2 = pickle.loads(pickle.dumps(cm))
+        self.assertEqual(cm, cm2)
+        self.assertEqual('KGLD.TO.W.0021', cm2.vtec[-1].event_id)
+        self.assertIs(cm2, cm2.vtec[-1].container)
+
+        # Messages from before there were slots still load
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            alerts = pickle.load(f)
+        self.assertEqual(['020063', '020065', '020109', '020179', '020203'], alerts[0][1].FIPS6)
+        self.assertEqual('Tornado Watch', alerts[0][1].event)
+
+    def test_lazy(self):
+        cm = CAP.CAPMessage(TestCAP._get_test_messages()[0])
+        self.assertTrue(cm.applies_to_fips('020109'))
+        self.assertIsNone(cm._vtec)
+        self.assertIsNone(cm._polygon)
+        vtec = cm.vtec
+        self.assertIs(vtec, cm.vtec)
+        self.assertIsNone(cm._polygon)
+        polygon = cm.polygon
+        self.assertIs(polygon, cm.vtec[-1].polygon)
+        self.assertIs(polygon, cm.polygon)
+
+    def test_applies_to_fips(self):
+        # The same as SAMEMessage
+        for counties in ("037001-037037-037185", "137001", "937001-037037"):
+            entry = TestCAP._get_test_messages()[0]
+            entry.find('{urn:oasis:names:tc:emergency:cap:1.1}geocode/{http://www.w3.org/2005/Atom}value').text = \
+                counties.replace("-", " ")
+            cm = CAP.CAPMessage(entry)
+            sm = SAMEMessage("-WXR-TOR-%s+0030-1181503-KRAH/NWS-" % counties)
+            for fips in ("037001", "137001", "937001", "37001", "047001", "037037", "137037", "037185", "037186"):
+                self.assertEqual(sm.applies_to_fips(fips), cm.applies_to_fips(fips), counties + " " + fips)
+        self.assertRaises(ValueError, cm.applies_to_fips, "0037001")
+
+    def test_empty_date(self):
+        entry = TestCAP._get_test_messages()[0]
+        for text in (None, " "):
+            entry.find('{urn:oasis:names:tc:emergency:cap:1.1}effective').text = text
+            cm = CAP.CAPMessage(entry)
+            self.assertIsNone(cm.effective)
+            self.assertEqual(1463879700.0, cm.expires)
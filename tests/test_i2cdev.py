@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from RPiNWR.i2cdev import *
+from RPiNWR.Si4707 import *
+from RPiNWR.Si4707.mock import MockContext
+
+
+class FakeI2CDev(object):
+    """
+    Stands in for an open /dev/i2c-* file, passing the I2C_RDWR transfers along to the mock Si4707.
+    """
+
+    def __init__(self, chip, address=0x11):
+        self.chip = chip
+        self.address = address
+        self.transfers = []
+        self.closed = False
+
+    def fileno(self):
+        return 99
+
+    def ioctl(self, fd, request, arg):
+        if fd != 99 or request != I2C_RDWR:
+            raise OSError(22, "Invalid argument")
+        transfer = []
+        for i in range(0, arg.nmsgs):
+            msg = arg.msgs[i]
+            if msg.addr != self.address:
+                raise OSError(6, "No such device or address")
+            if msg.flags & I2C_M_RD:
+                buf = bytearray(msg.len)
+                self.chip.read_into(buf)
+                for j in range(0, msg.len):
+                    msg.buf[j] = buf[j]
+                transfer.append(("r", bytes(buf)))
+            else:
+                data = bytes(msg.buf[0:msg.len])
+                self.chip.write_bytes(data)
+                transfer.append(("w", data))
+        self.transfers.append(transfer)
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+class TestI2CDev(unittest.TestCase):
+    def test_transfers(self):
+        fake = FakeI2CDev(MockContext())
+        dev = I2CDevice(0x11, device=fake, ioctl=fake.ioctl)
+        dev.write(memoryview(b'\x10'))  # GET_REV
+        buf = bytearray(9)
+        self.assertEqual(9, dev.read_into(buf))
+        self.assertEqual(bytearray([128, 7, 50, 48, 209, 149, 50, 48, 0]), buf)
+        self.assertEqual(b'\x80\x07', bytes(buf[0:2]))
+
+        self.assertEqual([[("w", b'\x10')], [("r", bytes(buf))]], fake.transfers)
+
+        self.assertRaises(ValueError, dev.write, b'')
+        self.assertRaises(ValueError, dev.read_into, bytearray(33))
+
+    def test_radio(self):
+        chip = MockContext()
+        fake = FakeI2CDev(chip)
+        with I2CDevContext(device=fake, ioctl=fake.ioctl, reset=chip.reset_radio) as context:
+            with Si4707(context) as radio:
+                radio.power_on({"frequency": 162.4})
+                self.assertEqual(63, radio.get_volume())
+                frequency, rssi, snr = radio.tune_status()
+                self.assertEqual(162.4, frequency)
+                self.assertEqual(chip.rssi, rssi)
+        self.assertTrue(fake.closed)
+        self.assertFalse(chip.power)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+__author__ = 'ke4roh'
+# Copyright © 2016 James E. Scarborough
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import unittest
+from RPiNWR.SAME import average_message, SAMEMessage
+from RPiNWR.redecode import main, decode_record
+
+
+class TestRedecode(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "dirty_messages.json"), "r") as f:
+            self.records = [{"headers": m["headers"], "time": m["headers"][0][2], "transmitter": m["transmitter"]}
+                            for m in json.load(f)]
+
+    def test_redecode(self):
+        with tempfile.TemporaryDirectory() as d:
+            archive = os.path.join(d, "archive.jsonl")
+            first = os.path.join(d, "first.jsonl")
+            second = os.path.join(d, "second.jsonl")
+            report = os.path.join(d, "report.txt")
+            with open(archive, "w", encoding="utf-8") as f:
+                for r in self.records:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                f.write('{"headers": [], "transmitter": "WXL58"}\n')
+
+            main([archive, "-o", first, "--workers", "2", "--chunk-size", "3"])
+            with open(first, "r", encoding="utf-8") as f:
+                decoded = [json.loads(line) for line in f]
+            self.assertEqual(len(self.records) + 1, len(decoded))
+            for r, d in zip(self.records, decoded):
+                message, confidence = average_message(r["headers"], r["transmitter"])
+                self.assertEqual((r["time"], message, confidence), (d["time"], d["message"], d["confidence"]))
+            self.assertIn("error", decoded[-1])
+
+            # Pretend the first run decoded one of them differently, and had one more
+            decoded[1]["message"] = "-WXR-RWT-037183+0030-1232003-KRAH/NWS-"
+            with open(first, "w", encoding="utf-8") as f:
+                for d in decoded + decoded[:1]:
+                    f.write(json.dumps(d, ensure_ascii=False) + "\n")
+            tally = main([archive, "-o", second, "--previous", first, "--report", report, "--workers", "2"])
+            self.assertEqual([2, len(decoded) + 1], [n for n, old, new in tally.messages_changed])
+            self.assertEqual((decoded[0]["message"], None), tally.messages_changed[-1][1:])
+            self.assertEqual((len(decoded), 0, 1, 1),
+                             (tally.records, tally.confidence_changed, tally.errors, tally.removed))
+            with open(report, "r", encoding="utf-8") as f:
+                self.assertIn("2 messages changed, 0 confidences changed, 1 errors, 1 removed", f.read())
+
+    def test_to_dict(self):
+        for r in self.records[:3]:
+            m = SAMEMessage(r["transmitter"], [tuple(h) for h in r["headers"]])
+            d = json.loads(json.dumps(m.to_dict(), ensure_ascii=False))
+            self.assertEqual(r["transmitter"], d["transmitter"])
+            message, confidence = m.get_SAME_message()
+            self.assertEqual((message, list(confidence)), (d["message"], d["confidence"]))
+            d = decode_record(d)
+            self.assertEqual((message, list(confidence)), (d["message"], d["confidence"]))
+
+    def test_unknown_transmitter(self):
+        r = self.records[0]
+        d = decode_record(dict(r, transmitter=None), r["transmitter"])
+        self.assertEqual(list(average_message(r["headers"], r["transmitter"])), [d["message"], d["confidence"]])
+        self.assertNotIn("error", d)
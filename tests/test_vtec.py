@@ -124,3 +124,35 @@ class TestVTEC(unittest.TestCase):
                 self.assertIsNotNone(default_VTEC_sort(valerts[i], valerts[j]), str(valerts[i]) + str(valerts[j]))
                 self.assertIsNotNone(default_VTEC_sort(valerts[j], valerts[i]), str(valerts[j]) + str(valerts[i]))
 
+    def test_parse_vtec_time(self):
+        import RPiNWR.VTEC as VTEC
+        import calendar
+        import time
+        for t in ('160522T0039Z', '991231T2359Z', '000101T0000Z', '680229T1200Z', '690301T0000Z'):
+            self.assertEqual(calendar.timegm(time.strptime(t.replace("Z", "UTC"), '%y%m%dT%H%M%Z')),
+                             VTEC._parse_vtec_time(t), t)
+        self.assertIsNone(VTEC._parse_vtec_time('000000T0000Z'))
+        for t in ('160532T0039Z', '160522T2439Z', '160522T0039', '16O522T0039Z', '160522 0039Z'):
+            self.assertRaises(ValueError, VTEC._parse_vtec_time, t)
+
+    def test_slots_and_identity(self):
+        v1 = PrimaryVTEC('/O.CON.KGLD.TO.W.0021.160522T0039Z-160522T0115Z/')
+        v2 = PrimaryVTEC('/O.CON.KGLD.TO.W.0021.160522T0039Z-160522T0115Z/')
+        v3 = PrimaryVTEC('/O.EXT.KGLD.TO.W.0021.160522T0039Z-160522T0130Z/')
+        self.assertFalse(hasattr(v1, '__dict__'))
+        self.assertIs(v1.office_id, v2.office_id)
+        self.assertIs(v1.event_id, v2.event_id)
+        self.assertEqual(v1, v2)
+        self.assertEqual(hash(v1), hash(v2))
+        self.assertNotEqual(v1, v3)
+        self.assertEqual(2, len({v1, v2, v3}))
+        h = HyrdologicVTEC('/SRAW4.1.ER.160521T2100Z.160522T1800Z.160524T1200Z.NR/', v1)
+        self.assertFalse(hasattr(h, '__dict__'))
+
+        # Codes pickled before there were slots still load, and the same code from different updates differs
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "kgld.cap.p"), "rb") as f:
+            alerts = pickle.load(f)
+        valerts = [v for a, c in alerts for v in c.vtec if v.event_id == "KGLD.TO.A.0204"]
+        self.assertEqual(len(set((v.container.id, v.container.published) for v in valerts)), len(set(valerts)))
+        self.assertEqual(valerts[0], pickle.loads(pickle.dumps(valerts[0])))
+        self.assertFalse(hasattr(pickle.loads(pickle.dumps(valerts[0])), '__dict__'))